@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+import glob
+import gzip
+import json
+import os
+
+from locks import COMPACT_LOCK, file_lock, replace_file
+
+"""
+Story Archive
+
+Keeps the live store small. compact() moves stories older than the retention
+period out of the store, a batch at a time, into gzipped JSON Lines files
+partitioned by the day they were fetched (archive/stories-YYYY-MM-DD.jsonl.gz).
+Posted history is kept that way instead of being thrown away.
+
+A batch is written to the archive before it's deleted from the store, so a
+crash in between can leave a story in both places; read_archive skips any
+repeats within a partition. Each write replaces the partition whole, so a
+crash can't leave it truncated, and only one process compacts at a time.
+"""
+
+ARCHIVE_DIR = 'archive'
+
+# Tuning parameters
+RETENTION_DAYS = 7
+COMPACT_BATCH = 1000
+
+def partition_path(day, archive_dir=ARCHIVE_DIR):
+    return os.path.join(archive_dir, f'stories-{day}.jsonl.gz')
+
+def compact(store, retention_days=RETENTION_DAYS, archive_dir=ARCHIVE_DIR,
+            batch_size=COMPACT_BATCH):
+    """Archive and remove stories older than the retention period.
+
+    Returns how many stories were moved.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    cutoff = (datetime.now() - timedelta(days=retention_days)).isoformat()
+    moved = 0
+
+    with file_lock(COMPACT_LOCK):
+        while True:
+            batch = store.older_than(cutoff, batch_size)
+            if not batch:
+                break
+
+            by_day = {}
+            for entry in batch:
+                by_day.setdefault(entry['timestamp'][:10], []).append(entry)
+
+            for day, entries in by_day.items():
+                append_partition(partition_path(day, archive_dir), entries)
+
+            store.remove_ids([entry['id'] for entry in batch])
+            moved += len(batch)
+
+    return moved
+
+def append_partition(path, entries):
+    """Add entries to a partition as a new gzip member; readers see one stream."""
+    member = gzip.compress(''.join(json.dumps(entry) + '\n' for entry in entries).encode())
+    existing = b''
+    if os.path.exists(path):
+        with open(path, 'rb') as infile:
+            existing = infile.read()
+    replace_file(path, existing + member, 'wb')
+
+def partition_days(archive_dir=ARCHIVE_DIR):
+    """Days that have an archive partition, oldest first."""
+    days = []
+    for path in glob.glob(os.path.join(archive_dir, 'stories-*.jsonl.gz')):
+        days.append(os.path.basename(path)[len('stories-'):-len('.jsonl.gz')])
+    return sorted(days)
+
+def read_partition(day, archive_dir=ARCHIVE_DIR):
+    seen = set()
+    with gzip.open(partition_path(day, archive_dir), 'rt') as infile:
+        for line in infile:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry['id'] in seen:
+                continue
+            seen.add(entry['id'])
+            yield entry
+
+def read_archive(archive_dir=ARCHIVE_DIR, since=None, until=None, newest_first=False):
+    """Stream archived stories a partition at a time.
+
+    since / until are ISO dates (YYYY-MM-DD) bounding the fetch day; until
+    is exclusive.
+    """
+    days = partition_days(archive_dir)
+    if newest_first:
+        days.reverse()
+    for day in days:
+        if since is not None and day < since[:10]:
+            continue
+        if until is not None and day >= until[:10]:
+            continue
+        yield from read_partition(day, archive_dir)
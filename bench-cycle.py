@@ -0,0 +1,319 @@
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.utils import format_datetime
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import clusters
+import ingest
+import metrics
+import posting
+import prompts
+from feeds import make_session
+from routing import DEFAULT_TARGET, load_targets
+from store import Store
+
+"""
+Cycle Benchmark
+
+Times each stage of a cycle against stores of increasing size, with no live
+feeds and no API calls. For each size it builds a store of that many
+synthetic stories (spread over the retention period, in a realistic mix of
+states), serves a set of synthetic RSS feeds from a local HTTP server, and
+swaps the model client for a deterministic fake with a configurable
+latency. Then it times, in order:
+
+  fetch_and_store_rss_feeds, find_unrated_stories, rate_stories,
+  cluster_stories, route_stories, pick_story, post_story and dequeue_story
+
+The pick and post stages run for the default target, since there's no
+targets.json in the scratch directory.
+
+Everything runs in a scratch directory, so the query log, feed state and
+store are thrown away afterwards.
+
+The report is JSON: one result per size with each stage's wall time and the
+per-stage breakdown from metrics.py. Save one as a baseline and pass it to
+--baseline on a later run to flag stages that got slower.
+
+Usage: bench-cycle.py [--sizes 1000 10000 100000] [--llm-latency 0.5]
+                      [--output report.json] [--baseline old.json]
+"""
+
+SIZES = [1000, 10000, 100000]
+
+FEEDS = 20
+ITEMS_PER_FEED = 50
+UNRATED = 200
+POSTED_PER_DAY = 100
+QUEUED = 5
+
+# A stage this much slower than the baseline is flagged
+REGRESSION = 1.2
+
+WORDS = ('senate', 'vote', 'storm', 'markets', 'election', 'court', 'ruling',
+         'strike', 'talks', 'ceasefire', 'budget', 'climate', 'summit', 'trade',
+         'minister', 'protest', 'quake', 'flood', 'inflation', 'rates', 'launch',
+         'report', 'probe', 'deal', 'border', 'health', 'vaccine', 'energy',
+         'prices', 'union', 'police', 'wildfire', 'tariffs', 'satellite', 'bank')
+
+def headline(rng):
+    words = rng.sample(WORDS, rng.randint(4, 9))
+    return ' '.join(words).capitalize()
+
+def make_stories(count, rng):
+    """A store's worth of stories over the last week, newest first."""
+    now = datetime.now()
+    span = timedelta(days=6).total_seconds()
+    stories = []
+    for index in range(count):
+        age = timedelta(seconds=span * index / count)
+        entry = {
+            'feed': f'bench-feed-{index % FEEDS}',
+            'id': f'https://bench.example.com/stored/{index}',
+            'title': headline(rng),
+            'link': f'https://bench.example.com/stored/{index}',
+            'published': (now - age).isoformat(),
+            'timestamp': (now - age).isoformat(),
+            'channel': f'Bench {index % FEEDS}',
+            'state': 'old',
+        }
+        entry['canonical'] = entry['link'][len('https://'):]
+        if index < UNRATED:
+            entry['state'] = 'avail'
+        elif rng.random() < POSTED_PER_DAY * 6 / count:
+            entry['state'] = 'posted'
+            entry['post_timestamp'] = entry['timestamp']
+            entry['target'] = DEFAULT_TARGET
+        stories.append(entry)
+
+    # A roundup that's been waiting long enough to come due
+    cutoff = (now - timedelta(hours=posting.QUEUE_DELAY + 1)).isoformat()
+    due = [entry for entry in stories[UNRATED:] if entry['timestamp'] < cutoff][:QUEUED]
+    for entry in due:
+        entry.pop('post_timestamp', None)
+        entry.update({'state': 'queued', 'schedule_timestamp': due[0]['timestamp'],
+                      'category': 'worldnews', 'target': DEFAULT_TARGET})
+    return stories
+
+def make_feeds(rng):
+    """{path: RSS document}, all items new to the store."""
+    now = datetime.now().astimezone()
+    documents = {}
+    for feed in range(FEEDS):
+        items = []
+        for index in range(ITEMS_PER_FEED):
+            link = f'https://bench.example.com/feed{feed}/item{index}'
+            items.append(f'<item><title>{headline(rng)}</title><link>{link}</link>'
+                         f'<guid>{link}</guid>'
+                         f'<pubDate>{format_datetime(now - timedelta(minutes=index))}</pubDate>'
+                         f'<description>Synthetic story {index} of feed {feed}.</description></item>')
+        documents[f'/feed{feed}.xml'] = (
+            '<?xml version="1.0" encoding="utf-8"?><rss version="2.0"><channel>'
+            f'<title>Bench Feed {feed}</title><link>https://bench.example.com/</link>'
+            f'<description>Synthetic feed</description>{"".join(items)}'
+            '</channel></rss>').encode()
+    return documents
+
+def serve_feeds(documents):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_GET(self):
+            body = documents.get(self.path)
+            if body is None:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/rss+xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(('localhost', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+class FakeLLM:
+    """Stands in for LLMClient: canned, deterministic replies after a delay."""
+
+    def __init__(self, latency=0.0, concurrency=4):
+        self.latency = latency
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.calls = 0
+
+    def complete(self, prompt, site, deadline=None, json_mode=False):
+        with metrics.timed('llm', site=site):
+            time.sleep(self.latency)
+            self.calls += 1
+            if site == 'rate':
+                return self.rate(prompt)
+            if site == 'dedup':
+                return "0, None, None)"
+            return json.dumps({'ids': [0], 'title': 'Bench roundup', 'body': None})
+
+    def rate(self, prompt):
+        stories = prompt.split('The stories are:\n', 1)[1].split('\nThe list is:', 1)[0]
+        rows = []
+        for line in stories.splitlines():
+            index, title = json.loads(line)
+            if index < prompts.seed_count():
+                continue
+            stars = 1 + int(hashlib.sha1(title.encode()).hexdigest(), 16) % 5
+            rows.append(json.dumps([index, '*' * stars, 'world', title.split()[0]]))
+        return '\n'.join(rows)
+
+    def submit(self, prompt, site, deadline=None, json_mode=False):
+        return self.executor.submit(self.complete, prompt, site, deadline, json_mode)
+
+    def report(self):
+        return f'{self.calls} fake calls'
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+class FakePoster:
+    def post(self, user, magazine, title, url=None, body=None):
+        return ''
+
+    def close(self):
+        pass
+
+def timed_stage(timings, name, function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    timings[name] = round(time.perf_counter() - start, 4)
+    return result
+
+def run_size(size, args, seed_path):
+    rng = random.Random(size)
+    metrics.reset()
+    workdir = tempfile.mkdtemp(prefix='bench-cycle-')
+    previous_dir = os.getcwd()
+    server = serve_feeds(make_feeds(rng))
+    client = FakeLLM(args.llm_latency)
+    poster = FakePoster()
+
+    try:
+        os.chdir(workdir)
+        shutil.copy(seed_path, prompts.SEED_PATH)
+        ingest.seen_ids.clear()
+
+        store = Store()
+        build_start = time.perf_counter()
+        store.insert_many(make_stories(size, rng))
+        build_time = time.perf_counter() - build_start
+
+        host, port = server.server_address[:2]
+        feed_urls = [f'http://{host}:{port}/feed{feed}.xml' for feed in range(FEEDS)]
+        timings = {}
+
+        # Silence the stages' own chatter; the report is what matters here
+        with open(os.devnull, 'w') as devnull:
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                timed_stage(timings, 'fetch_and_store_rss_feeds', ingest.fetch_and_store_rss_feeds,
+                            store, feed_urls, {}, make_session())
+                unrated = timed_stage(timings, 'find_unrated_stories',
+                                      ingest.find_unrated_stories, store)
+                timed_stage(timings, 'rate_stories', ingest.rate_stories, store, client, unrated)
+                timed_stage(timings, 'cluster_stories', clusters.cluster_stories, store)
+                targets = load_targets()
+                timed_stage(timings, 'route_stories', ingest.route_stories, store, targets)
+
+                target = targets[0]
+                window_begin = (datetime.now()
+                                - timedelta(minutes=target.story_window)).isoformat()
+                timed_stage(timings, 'pick_story', ingest.pick_story, store, target,
+                            store.count_posted_since(window_begin, target=target.name))
+                timed_stage(timings, 'post_story', posting.post_story,
+                            store, client, poster, target)
+
+                threshold = (datetime.now() - timedelta(hours=posting.QUEUE_DELAY)).isoformat()
+                queued = store.queued_before(threshold, limit=1, target=target.name)
+                if queued:
+                    timed_stage(timings, 'dequeue_story', posting.dequeue_story,
+                                store, client, poster, queued[0], target)
+            finally:
+                sys.stdout = stdout
+
+        store.close()
+    finally:
+        os.chdir(previous_dir)
+        server.shutdown()
+        server.server_close()
+        client.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {'stories': size,
+            'build_s': round(build_time, 4),
+            'timings_s': timings,
+            'total_s': round(sum(timings.values()), 4),
+            'stages': {stage: {'calls': calls, 'seconds': round(total, 4)}
+                       for stage, (calls, total) in sorted(metrics.stage_totals().items())},
+            'llm_calls': client.calls}
+
+def compare(report, baseline):
+    """Stages that are more than REGRESSION times slower than the baseline."""
+    before = {result['stories']: result for result in baseline['results']}
+    regressions = []
+    for result in report['results']:
+        old = before.get(result['stories'])
+        if old is None:
+            continue
+        for name, seconds in result['timings_s'].items():
+            old_seconds = old['timings_s'].get(name)
+            # Ignore noise in stages that barely take any time
+            if old_seconds and seconds > 0.01 and seconds > old_seconds * REGRESSION:
+                regressions.append({'stories': result['stories'], 'stage': name,
+                                    'baseline_s': old_seconds, 'now_s': seconds,
+                                    'ratio': round(seconds / old_seconds, 2)})
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Time each cycle stage against synthetic stores.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--llm-latency', type=float, default=0.0,
+                        help='seconds each fake model call takes')
+    parser.add_argument('--output', help='write the report here instead of stdout')
+    parser.add_argument('--baseline', help='earlier report to compare against')
+    args = parser.parse_args()
+
+    seed_path = os.path.abspath(prompts.SEED_PATH)
+    report = {'created': datetime.now().isoformat(timespec='seconds'),
+              'python': sys.version.split()[0],
+              'llm_latency_s': args.llm_latency,
+              'feeds': FEEDS,
+              'items_per_feed': ITEMS_PER_FEED,
+              'results': []}
+    for size in args.sizes:
+        report['results'].append(run_size(size, args, seed_path))
+        print(f"{size} stories: {report['results'][-1]['total_s']}s", file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline) as infile:
+            report['regressions'] = compare(report, json.load(infile))
+
+    text = json.dumps(report, indent=1)
+    if args.output:
+        with open(args.output, 'w') as outfile:
+            outfile.write(text + '\n')
+    else:
+        print(text)
+
+    if report.get('regressions'):
+        sys.exit(1)
+
+main()
@@ -0,0 +1,113 @@
+import argparse
+from datetime import datetime, timedelta
+import gc
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from store import Store
+
+"""
+History Benchmark
+
+Loads a week of story history from stores of increasing size, two ways, and
+compares memory and time:
+
+  dicts    Store.since(), one dict per story, then sorted by parsed
+           timestamp, the way a week of history used to be handled.
+  columns  Store.history(), the compact StoryHistory (history.py), then
+           sorted on its epoch timestamps.
+
+Memory is what the loaded history holds, measured with tracemalloc; time is
+the load plus the sort, measured separately without tracemalloc running.
+
+Usage: bench-history.py [stories per week ...]
+Prints one JSON line per size.
+"""
+
+SIZES = [10000, 50000, 150000]
+
+FEEDS = [f'https://feeds.example.com/{section}/rss.xml?edition=international'
+         for section in ('world', 'us', 'politics', 'business', 'technology', 'science',
+                         'health', 'climate', 'europe', 'asia', 'africa', 'americas',
+                         'middle-east', 'opinion', 'sport', 'culture', 'media', 'tech-policy')]
+STATES = ['old'] * 80 + ['avail'] * 5 + ['new'] * 3 + ['posted'] * 7 + ['dupe'] * 3 + ['queued'] * 2
+TOPICS = [f'topic {index}' for index in range(400)]
+
+def make_stories(count):
+    now = datetime.now()
+    span = timedelta(days=7).total_seconds()
+    stories = []
+    for index in range(count):
+        timestamp = (now - timedelta(seconds=span * index / count)).isoformat()
+        feed = index % len(FEEDS)
+        entry = {'feed': FEEDS[feed],
+                 'id': f'https://www.example.com/2026/10/story-number-{index}-about-something',
+                 'title': f'Story number {index} about something that happened today',
+                 'link': f'https://www.example.com/2026/10/story-number-{index}-about-something',
+                 'published': timestamp,
+                 'timestamp': timestamp,
+                 'state': random.choice(STATES),
+                 'channel': f'Example News {feed}'}
+        if entry['state'] != 'new':
+            entry.update({'rating': random.randint(0, 5),
+                          'category': random.choice(('world', 'us-only')),
+                          'topic': random.choice(TOPICS), 'target': 'news'})
+        if entry['state'] in ('posted', 'dupe'):
+            entry['post_timestamp'] = timestamp
+        stories.append(entry)
+    return stories
+
+def load_dicts(store, since):
+    entries = store.since(since)
+    entries.sort(key=lambda entry: datetime.fromisoformat(entry['timestamp']))
+    return entries
+
+def load_columns(store, since):
+    table = store.history(since)
+    table.order_by('timestamp')
+    return table
+
+def measure(load, store, since):
+    gc.collect()
+    start = time.perf_counter()
+    result = load(store, since)
+    elapsed = time.perf_counter() - start
+    del result
+
+    gc.collect()
+    tracemalloc.start()
+    result = load(store, since)
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return elapsed, memory
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare loading a week of history as dicts and as columns.')
+    parser.add_argument('sizes', type=int, nargs='*', default=SIZES, metavar='size',
+                        help=f'stories per week (default: {" ".join(map(str, SIZES))})')
+    sizes = parser.parse_args().sizes
+    random.seed(1)
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            store = Store(os.path.join(tmpdir, 'bench.db'))
+            store.insert_many(make_stories(size))
+            since = (datetime.now() - timedelta(days=7, minutes=1)).isoformat()
+
+            dict_time, dict_memory = measure(load_dicts, store, since)
+            column_time, column_memory = measure(load_columns, store, since)
+            store.close()
+
+        print(json.dumps({'stories': size,
+                          'dicts_s': round(dict_time, 4),
+                          'columns_s': round(column_time, 4),
+                          'dicts_mb': round(dict_memory / 2**20, 2),
+                          'columns_mb': round(column_memory / 2**20, 2),
+                          'time_ratio': round(column_time / dict_time, 3),
+                          'memory_ratio': round(column_memory / dict_memory, 3)}))
+
+main()
@@ -0,0 +1,120 @@
+import argparse
+from datetime import datetime, timedelta
+import json
+import os
+import random
+import tempfile
+import time
+
+from store import Store
+
+"""
+Store Benchmark
+
+Times one cycle's worth of state transitions against stores of increasing
+size: the new->avail sweep, marking the overflow 'old', writing back a batch
+of ratings and marking a roundup posted. Each cycle is run twice, once with
+one update (and one commit) per story, the way the scripts used to do it, and
+once through Store.update_many. If tinydb is installed, the old TinyDB
+per-story updates are timed as well, for the real before/after.
+
+Usage: bench-store.py [size ...]
+Prints one JSON line per size.
+"""
+
+SIZES = [1000, 10000, 50000]
+
+OVERFLOW = 200
+RATED = 25
+ROUNDUP = 5
+
+def make_stories(count):
+    now = datetime.now()
+    stories = []
+    for index in range(count):
+        stories.append({
+            'feed': f'https://feeds.example.com/{index % 19}',
+            'id': f'https://example.com/story/{index}',
+            'title': f'Story number {index}',
+            'link': f'https://example.com/story/{index}',
+            'published': now.isoformat(),
+            'timestamp': (now - timedelta(seconds=index * 30)).isoformat(),
+            'state': random.choice(['new', 'avail', 'old', 'posted', 'dupe']),
+            'channel': f'Channel {index % 19}',
+        })
+    return stories
+
+def pick_changes(stories):
+    sample = random.sample(stories, OVERFLOW + RATED + ROUNDUP)
+    changes = [(entry['id'], {'state': 'old'}) for entry in sample[:OVERFLOW]]
+    changes += [(entry['id'], {'rating': 3, 'category': 'world',
+                               'topic': 'bench', 'state': 'avail'})
+                for entry in sample[OVERFLOW:OVERFLOW+RATED]]
+    post_timestamp = datetime.now().isoformat()
+    changes += [(entry['id'], {'state': 'dupe', 'post_timestamp': post_timestamp})
+                for entry in sample[OVERFLOW+RATED:]]
+    return changes
+
+def time_store(stories, changes, batched):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        store = Store(os.path.join(tmpdir, 'bench.db'))
+        store.insert_many(stories)
+
+        start = time.perf_counter()
+        store.change_state('new', 'avail')
+        store.by_state('highlight', 'avail', 'new')
+        if batched:
+            store.update_many(changes)
+        else:
+            for id, fields in changes:
+                store.update(id, fields)
+        elapsed = time.perf_counter() - start
+
+        store.close()
+    return elapsed
+
+def time_tinydb(stories, changes):
+    try:
+        from tinydb import TinyDB, Query
+    except ImportError:
+        return None
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = os.path.join(tmpdir, 'bench.json')
+        with open(path, 'w') as outfile:
+            json.dump({'_default': {str(index+1): entry
+                                    for index, entry in enumerate(stories)}},
+                      outfile)
+        db = TinyDB(path)
+        Feed = Query()
+
+        start = time.perf_counter()
+        db.update({'state': 'avail'}, Feed.state == 'new')
+        db.search((Feed.state == 'highlight') | (Feed.state == 'avail') | (Feed.state == 'new'))
+        for id, fields in changes:
+            db.update(fields, Feed.id == id)
+        elapsed = time.perf_counter() - start
+
+        db.close()
+    return elapsed
+
+parser = argparse.ArgumentParser(description="Time a cycle's state transitions against store size, per-story vs. batched.")
+parser.add_argument('sizes', type=int, nargs='*', default=SIZES, metavar='size',
+                    help=f'stories in the store (default: {" ".join(map(str, SIZES))})')
+sizes = parser.parse_args().sizes
+
+random.seed(0)
+for size in sizes:
+    stories = make_stories(size)
+    changes = pick_changes(stories)
+
+    result = {'stories': size,
+              'changes': len(changes),
+              'per_story_s': round(time_store(stories, changes, False), 4),
+              'batched_s': round(time_store(stories, changes, True), 4)}
+
+    tinydb_time = time_tinydb(stories, changes)
+    if tinydb_time is not None:
+        result['tinydb_per_story_s'] = round(tinydb_time, 4)
+
+    print(json.dumps(result))
@@ -0,0 +1,182 @@
+import time
+START_TIME = time.perf_counter()
+
+import argparse
+from contextlib import nullcontext
+from datetime import datetime
+import logging
+import signal
+import threading
+
+from archive import compact
+from feeds import load_feed_state, make_session, read_feed_list
+from ingest import (CYCLE_INTERVAL, FEEDS_FILE_PATH, expire_rating_cache,
+                    fetch_and_store_rss_feeds, parse_metrics, rating_metrics,
+                    read_auth_cookie, run_cycle)
+from llm import LLMClient
+from locks import INGEST_LOCK, POSTING_LOCK, LockBusy, file_lock
+from metrics import profiled, summary, timed, write_metrics
+from polling import PollScheduler
+from posters import make_poster
+from posting import post_entry, run_posting
+from routing import load_targets
+from store import Store
+
+"""
+Bot Daemon
+
+Long-running replacement for the run-bot.sh loop. The store, the LLM client,
+the poster, the HTTP session, the feed list and the feed validators are set
+up once and kept warm. Feeds are fetched as they come due; every
+CYCLE_INTERVAL the rate/pick stage (ingest.py) and then the dedup/post stage
+(posting.py) run, and every COMPACT_INTERVAL old stories are moved out to the
+archive.
+Stories rated FAST_PATH_RATING or better are dedup-checked and posted right
+after rating, without waiting for the pick/post stage.
+
+Each feed is polled on its own interval: the one given after the URL in
+rss-feeds.txt, in minutes, or otherwise one learned from how often the feed
+has new stories (polling.py), re-learned with each compaction. SIGTERM /
+SIGINT stop the daemon once the current stage is done; SIGHUP re-reads
+rss-feeds.txt and targets.json.
+
+rss-fetch.py, dedup-and-post.py or bot-report.py can be run by hand
+alongside it: the stages take the same cross-process locks (locks.py), and
+a stage whose lock stays busy is skipped until the next tick.
+
+Startup time and each cycle's time are logged, for comparison against the
+cost of starting two fresh interpreters every 10 minutes. Per-stage metrics
+go to metrics/bot-daemon.prom after every tick (see metrics.py); --profile
+runs the first full cycle under cProfile.
+"""
+
+# Configure logging
+logging.basicConfig(level=logging.INFO,
+                    format='%(asctime)s - %(levelname)s - %(message)s',
+                    handlers=[logging.FileHandler('rss-feed-log.log'),
+                              logging.StreamHandler()])
+
+logger = logging.getLogger(__name__)
+
+# Tuning parameters
+COMPACT_INTERVAL = 60 # in minutes
+TICK = 60 # in seconds
+
+stopping = threading.Event()
+reload_feeds = threading.Event()
+
+def handle_stop(signum, frame):
+    logger.info(f'Got signal {signum}; stopping after this stage')
+    stopping.set()
+
+def handle_reload(signum, frame):
+    reload_feeds.set()
+
+def run_daemon(args):
+    signal.signal(signal.SIGTERM, handle_stop)
+    signal.signal(signal.SIGINT, handle_stop)
+    signal.signal(signal.SIGHUP, handle_reload)
+
+    store = Store()
+    client = LLMClient(api_key=read_auth_cookie('openai-key'))
+    poster = make_poster()
+    session = make_session()
+    feed_state = load_feed_state()
+    scheduler = PollScheduler(read_feed_list(FEEDS_FILE_PATH))
+    scheduler.learn(store)
+    targets = load_targets()
+
+    logger.info(f'Startup took {time.perf_counter() - START_TIME:.2f}s '
+                f'({len(scheduler.fixed)} feeds, {len(targets)} targets)')
+
+    def post_now(entry, target):
+        with file_lock(POSTING_LOCK):
+            return post_entry(store, client, poster, entry, target)
+
+    next_cycle = 0
+    next_compact = 0
+
+    while not stopping.is_set():
+        if reload_feeds.is_set():
+            reload_feeds.clear()
+            scheduler.set_feeds(read_feed_list(FEEDS_FILE_PATH))
+            scheduler.learn(store)
+            targets = load_targets()
+            logger.info(f'Reloaded feed list ({len(scheduler.fixed)} feeds) '
+                        f'and targets ({len(targets)})')
+
+        now = time.time()
+        cycle_due = now >= next_cycle
+
+        # With --profile, the first full cycle runs under cProfile
+        with profiled() if args.profile and cycle_due else nullcontext():
+            # Fetch stage: only the feeds that are due
+            due = scheduler.due(now)
+            if due:
+                fetch_start = time.perf_counter()
+                try:
+                    with file_lock(INGEST_LOCK, timeout=0), timed('pipeline', stage='fetch'):
+                        new_counts = fetch_and_store_rss_feeds(store, due, feed_state, session)
+                except LockBusy as e:
+                    # They stay due, for the next tick
+                    logger.info(f'{e}; fetching next tick')
+                else:
+                    scheduler.record(due, new_counts, feed_state, now)
+                    logger.info(f'Fetched {len(due)} feeds in '
+                                f'{time.perf_counter() - fetch_start:.2f}s, '
+                                f"{parse_metrics['feeds']} changed, {parse_metrics['items']} items, "
+                                f"{parse_metrics['parsed']} parsed, {parse_metrics['new']} new")
+
+            # Rate, pick, dedup and post stages, on the old 10-minute cadence
+            if cycle_due and not stopping.is_set():
+                cycle_start = time.perf_counter()
+
+                try:
+                    # Everything's been fetched already, so nothing more to fetch here;
+                    # breaking stories are posted as soon as they're rated
+                    with file_lock(INGEST_LOCK, timeout=0), timed('pipeline', stage='rate_pick'):
+                        run_cycle(store, client, [], feed_state, session,
+                                  post_now=post_now, targets=targets)
+                    ingest_time = time.perf_counter() - cycle_start
+
+                    if not stopping.is_set():
+                        with file_lock(POSTING_LOCK, timeout=0), timed('pipeline', stage='post'):
+                            run_posting(store, client, poster, targets)
+                except LockBusy as e:
+                    logger.info(f'{e}; trying the cycle again next tick')
+                else:
+                    next_cycle = now + CYCLE_INTERVAL * 60
+                    logger.info(f'Cycle took {time.perf_counter() - cycle_start:.2f}s '
+                                f'(rate/pick {ingest_time:.2f}s)')
+                    logger.info(f'Rating: {rating_metrics}')
+                    logger.info(f'Stage times so far: {summary()}')
+                    logger.info('LLM usage so far:\n' + client.report())
+
+        if cycle_due:
+            args.profile = False
+
+        # Compaction stage: move aged-out stories to the archive
+        if now >= next_compact and not stopping.is_set():
+            next_compact = now + COMPACT_INTERVAL * 60
+            compact_start = time.perf_counter()
+            with timed('pipeline', stage='compact'):
+                moved = compact(store)
+                expire_rating_cache(store)
+            scheduler.learn(store)
+            logger.info(f'Poll intervals: {scheduler.report(feed_state)}')
+            logger.info(f'Archived {moved} stories in '
+                        f'{time.perf_counter() - compact_start:.2f}s')
+
+        write_metrics('bot-daemon')
+        stopping.wait(TICK)
+
+    logger.info('LLM usage:\n' + client.report())
+    client.close()
+    poster.close()
+    store.close()
+    logger.info(f'Stopped at {datetime.now().isoformat()}')
+
+parser = argparse.ArgumentParser(description='Run the bot until stopped.')
+parser.add_argument('--profile', action='store_true',
+                    help='profile the first full cycle (see metrics.PROFILE_PATH)')
+run_daemon(parser.parse_args())
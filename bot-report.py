@@ -0,0 +1,336 @@
+import argparse
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+import heapq
+import json
+import signal
+import sys
+
+from archive import RETENTION_DAYS, partition_days, read_partition
+from history import StoryHistory
+from querylog import QUERY_LOG_PATH, read_queries
+from routing import STORY_WINDOW, load_targets
+from store import Store
+
+"""
+Bot Report
+
+One reporting tool over the story store, the archive and the query log,
+replacing dump-db.py and dump-highlights.py. Output is streamed, so it can
+be piped into head or less.
+
+  stories     Stories in some states over a time range, newest first: posted
+              stories by default, like dump-db.py. Each state is paged
+              through on its index and the pages merged, so months of
+              history cost no more memory than a page. --archive carries on
+              into the archived history.
+  highlights  Stories currently in the highlight state, as a list of titles.
+  posts       Posts per window (the target's story window by default), per
+              target, and how many windows reached the target's limit.
+  ratings     How each feed's stories were rated.
+  queue       How many stories are waiting in each state for each target,
+              the unrated backlog, and the oldest queued story.
+  cost        Model calls per day and call site, with the tokens they used
+              and what they cost. Calls logged without token usage (from
+              before it was logged) are estimated from their sizes.
+
+posts and ratings read the live store with Store.history() and the archive
+a day's partition at a time, each as a compact StoryHistory (history.py),
+and keep only the running totals.
+
+Usage: bot-report.py stories [--state posted dupe] [--since DATE] [--until DATE]
+                             [--by posted|fetched] [--target NAME] [--archive] [--json]
+       bot-report.py highlights
+       bot-report.py posts [--days 7] [--window MINUTES]
+       bot-report.py ratings [--days 7]
+       bot-report.py queue
+       bot-report.py cost [--days 30]
+"""
+
+STATE_MARKS = {
+    'new': 'N',
+    'avail': 'A',
+    'highlight': 'H',
+    'old': 'O',
+    'queued': 'Q',
+    'post': '!',
+    'posted': 'P',
+    'dupe': 'D',
+    'merged': 'M',
+    'unconfirmed': 'U',
+}
+
+# The states a story waits in before it's posted or let go
+QUEUE_STATES = ('new', 'avail', 'highlight', 'queued', 'post', 'unconfirmed')
+
+# List prices for llm.MODEL, in dollars per million tokens; prompt tokens
+# served from the provider's cache are billed at half price
+PROMPT_PRICE = 10.00
+CACHED_PROMPT_PRICE = 5.00
+COMPLETION_PRICE = 30.00
+
+# For calls logged without token usage: a rough characters-per-token for
+# English prompts
+CHARS_PER_TOKEN = 4
+
+def days_ago(days):
+    return (datetime.now() - timedelta(days=days)).isoformat()
+
+def short_time(iso):
+    """MM/DD HH:MM, straight from the ISO string."""
+    return f'{iso[5:7]}/{iso[8:10]} {iso[11:16]}'
+
+# stories / highlights
+
+# A story is posted, if at all, while it's still in the live store: within
+# the retention period of being fetched, plus a day's slack in case
+# compaction runs late
+MAX_FETCH_TO_POST = timedelta(days=RETENTION_DAYS + 1)
+
+def first_partition(since, column):
+    """The earliest archive day (partitions go by the day a story was
+    fetched) that can hold a story with `column` at or after `since`."""
+    earliest = datetime.fromisoformat(since)
+    if column == 'post_timestamp':
+        earliest -= MAX_FETCH_TO_POST
+    return earliest.date().isoformat()
+
+def archived_stories(states, column, since, until, target):
+    """Archived stories in these states, newest first by `column`."""
+    first = first_partition(since, column) if since is not None else None
+    for day in reversed(partition_days()):
+        if first is not None and day < first:
+            break
+        if until is not None and day > until[:10]:
+            continue
+        entries = [entry for entry in read_partition(day)
+                   if entry.get('state') in states and entry.get(column)
+                   and (since is None or entry[column] >= since)
+                   and (until is None or entry[column] < until)
+                   and (target is None or entry.get('target') == target)]
+        yield from sorted(entries, key=lambda entry: entry[column], reverse=True)
+
+def show_stories(args):
+    column = 'post_timestamp' if args.by == 'posted' else 'timestamp'
+    store = Store()
+    streams = [store.page_by(state, column, args.since, args.until, args.target)
+               for state in args.state]
+    entries = heapq.merge(*streams, key=lambda entry: entry[column], reverse=True)
+
+    for entry in entries:
+        print_story(entry, column, args.json)
+
+    if args.archive:
+        # The live store only holds what hasn't been archived yet, so the
+        # archive picks up where it leaves off
+        for entry in archived_stories(set(args.state), column, args.since, args.until,
+                                      args.target):
+            print_story(entry, column, args.json)
+    store.close()
+
+def print_story(entry, column, as_json):
+    if as_json:
+        sys.stdout.write(json.dumps(entry) + '\n')
+        return
+    print(f"{STATE_MARKS.get(entry['state'], '?')} {short_time(entry[column])} {entry['title']}")
+    print(f"  {entry.get('link')}")
+    if 'schedule_timestamp' in entry:
+        print(f"  {entry['schedule_timestamp']}")
+        if 'category' in entry:
+            print(f"  {entry['category']}")
+    print()
+
+def show_highlights(args):
+    store = Store()
+    for entry in store.page_by('highlight', 'timestamp'):
+        print(f"* {entry['title']}")
+    store.close()
+
+# posts / ratings
+
+def history_chunks(since):
+    """StoryHistory tables covering everything fetched since `since`: each
+    archive partition in the range, then the live store."""
+    for day in partition_days():
+        if day >= since[:10]:
+            table = StoryHistory()
+            table.extend(read_partition(day))
+            yield table
+    store = Store()
+    yield store.history(since)
+    store.close()
+
+def show_posts(args):
+    targets = {target.name: target for target in load_targets()}
+    window = args.window * 60
+    since = days_ago(args.days)
+    start = int(datetime.fromisoformat(since).timestamp())
+
+    # (window start, target) -> posts
+    windows = Counter()
+    # A story posted in range may have been fetched a day or so before it
+    for table in history_chunks(days_ago(args.days + 1)):
+        posted = table.where('state', 'posted')
+        for index in table.between('post_timestamp', start, sys.maxsize, posted):
+            bucket = start + (table.post_timestamp[index] - start) // window * window
+            windows[bucket, table.value('target', index)] += 1
+
+    names = sorted({name for bucket, name in windows} | set(targets), key=str)
+    print(f'Posts per {args.window} minutes, last {args.days} days')
+    print('Window       ' + ''.join(f'{str(name):>10}' for name in names))
+    for bucket in sorted({bucket for bucket, name in windows}):
+        print(datetime.fromtimestamp(bucket).strftime('%m/%d %H:%M  ')
+              + ''.join(f'{windows[bucket, name]:>10}' for name in names))
+
+    print()
+    for name in names:
+        counts = [total for (bucket, other), total in windows.items() if other == name]
+        if not counts:
+            continue
+        line = (f'{name}: {sum(counts)} posts, at most {max(counts)} in a window, '
+                f'{sum(counts) / len(counts):.1f} average in windows with any')
+        if name in targets:
+            line += (f'; {sum(total >= targets[name].max_stories for total in counts)} '
+                     f'windows at the limit of {targets[name].max_stories}')
+        print(line)
+
+def show_ratings(args):
+    since = days_ago(args.days)
+    start = int(datetime.fromisoformat(since).timestamp())
+
+    # feed -> rating (None if unrated) -> stories
+    ratings = defaultdict(Counter)
+    for table in history_chunks(since):
+        recent = table.between('timestamp', start, sys.maxsize)
+        for (feed, rating), total in Counter(
+                (table.feed[index], table.rating[index]) for index in recent).items():
+            ratings[table.values['feed'][feed]][rating if rating >= 0 else None] += total
+
+    print(f'Ratings per feed, last {args.days} days')
+    print(f"{'Unrated':>8}" + ''.join(f'{stars:>6}' for stars in range(6))
+          + f"{'Avg':>6}  Feed")
+    for feed, counts in sorted(ratings.items(), key=lambda item: -sum(item[1].values())):
+        rated = sum(total for rating, total in counts.items() if rating is not None)
+        average = (sum(rating * total for rating, total in counts.items() if rating is not None)
+                   / rated if rated else 0)
+        print(f'{counts[None]:>8}' + ''.join(f'{counts[stars]:>6}' for stars in range(6))
+              + f'{average:>6.2f}  {feed}')
+
+# queue
+
+def show_queue(args):
+    store = Store()
+    counts = store.state_counts()
+    names = sorted({target for state, target, rated in counts}, key=lambda name: name or '')
+
+    print(f"{'Target':<14}" + ''.join(f'{state:>12}' for state in QUEUE_STATES)
+          + f"{'unrated':>12}")
+    for name in names:
+        totals = Counter()
+        for (state, target, rated), total in counts.items():
+            if target == name and state in QUEUE_STATES:
+                totals[state] += total
+                totals['unrated'] += 0 if rated else total
+        print(f'{name or "(unrouted)":<14}'
+              + ''.join(f'{totals[state]:>12}' for state in QUEUE_STATES + ('unrated',)))
+
+    print()
+    # Only routed stories get queued
+    for name in filter(None, names):
+        for entry in store.by_state('queued', order='timestamp', limit=1, target=name):
+            print(f"Oldest queued for {name}: fetched {short_time(entry['timestamp'])}: "
+                  f"{entry['title']}")
+    store.close()
+
+# cost
+
+def record_tokens(record):
+    """(prompt, cached, completion) tokens for a logged call, and whether
+    they're estimated because the record has no usage."""
+    usage = record.get('usage')
+    if usage is not None:
+        return (usage['prompt_tokens'], usage.get('cached_tokens', 0),
+                usage['completion_tokens'], False)
+    return (len(record['query']) / CHARS_PER_TOKEN, 0,
+            len(record['completion'] or '') / CHARS_PER_TOKEN, True)
+
+def show_cost(args):
+    # day -> site -> [calls, estimated calls, prompt, cached and completion tokens]
+    days = defaultdict(lambda: defaultdict(lambda: [0, 0, 0, 0, 0]))
+    for record in read_queries(args.log, since=days_ago(args.days)[:10]):
+        prompt, cached, completion, estimated = record_tokens(record)
+        totals = days[record['timestamp'][:10]][record.get('site')]
+        totals[0] += 1
+        totals[1] += estimated
+        totals[2] += prompt
+        totals[3] += cached
+        totals[4] += completion
+
+    print('Model calls and cost per day')
+    print('Day         Site        Calls  Est.  Prompt tok    Cached  Reply tok      Cost')
+    grand_total = 0.0
+    any_estimated = False
+    for day, sites in sorted(days.items()):
+        day_total = 0.0
+        for site, (calls, estimated, prompt, cached, completion) in sorted(sites.items(),
+                                                                            key=str):
+            cost = ((prompt - cached) * PROMPT_PRICE + cached * CACHED_PROMPT_PRICE
+                    + completion * COMPLETION_PRICE) / 1e6
+            day_total += cost
+            any_estimated = any_estimated or estimated
+            print(f'{day}  {str(site):<10}{calls:>7}{estimated:>6}{prompt:>12.0f}'
+                  f'{cached:>10.0f}{completion:>11.0f}  ${cost:>7.2f}')
+        print(f'{day}  {"total":<10}{"":>46}  ${day_total:>7.2f}')
+        grand_total += day_total
+    print(f'Last {args.days} days: ${grand_total:.2f}')
+    if any_estimated:
+        print(f'(Est.: calls logged without token usage, counted at '
+              f'{CHARS_PER_TOKEN} characters a token)')
+
+def main():
+    # Stop quietly when piped into head
+    signal.signal(signal.SIGPIPE, signal.SIG_DFL)
+
+    parser = argparse.ArgumentParser(description='Report on stories, posting and model usage.')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    stories = commands.add_parser('stories', help='list stories by state and time range')
+    stories.add_argument('--state', nargs='+', default=['posted', 'dupe'],
+                         choices=sorted(STATE_MARKS))
+    stories.add_argument('--since', help='ISO date or timestamp, inclusive')
+    stories.add_argument('--until', help='ISO date or timestamp, exclusive')
+    stories.add_argument('--by', choices=('posted', 'fetched'),
+                         help='which time to range and order on (default: posted, '
+                              'if only listing posted / dupe stories)')
+    stories.add_argument('--target', help='only stories routed to this target')
+    stories.add_argument('--archive', action='store_true',
+                         help='carry on into the archived history')
+    stories.add_argument('--json', action='store_true', help='print JSON lines')
+    stories.set_defaults(run=show_stories)
+
+    highlights = commands.add_parser('highlights', help='list highlighted stories')
+    highlights.set_defaults(run=show_highlights)
+
+    posts = commands.add_parser('posts', help='posts per window')
+    posts.add_argument('--days', type=int, default=7)
+    posts.add_argument('--window', type=int, default=STORY_WINDOW, help='in minutes')
+    posts.set_defaults(run=show_posts)
+
+    ratings = commands.add_parser('ratings', help='rating distribution per feed')
+    ratings.add_argument('--days', type=int, default=7)
+    ratings.set_defaults(run=show_ratings)
+
+    queue = commands.add_parser('queue', help='queue depth per target')
+    queue.set_defaults(run=show_queue)
+
+    cost = commands.add_parser('cost', help='model calls and cost per day')
+    cost.add_argument('--days', type=int, default=30)
+    cost.add_argument('--log', default=QUERY_LOG_PATH)
+    cost.set_defaults(run=show_cost)
+
+    args = parser.parse_args()
+    if args.command == 'stories' and args.by is None:
+        args.by = 'posted' if set(args.state) <= {'posted', 'dupe'} else 'fetched'
+    args.run(args)
+
+main()
@@ -0,0 +1,73 @@
+import argparse
+from collections import Counter
+import re
+
+from prompts import seed_count
+from querylog import QUERY_LOG_PATH, read_queries
+from responses import ParseError, parse_dedup, parse_ratings, parse_roundup
+
+"""
+Response Parsing Check
+
+Runs every reply in the query log back through the parsers in responses.py,
+and reports per call site how many parsed cleanly, how many were salvaged in
+part, and how many gave nothing. Rating replies are compared against the
+number of stories the prompt asked about. Useful after changing a prompt or
+a parser, against the real history of what the model sends back; the
+formats it's known to send are pinned down by the corpus in tests/replies.
+"""
+
+def expected_ratings(query):
+    """How many stories (not counting the seed examples) the rating prompt listed."""
+    head = query.split("The list is:", 1)[0]
+    return len(re.findall(r'^\[\d+, ', head, re.M)) - seed_count()
+
+parser = argparse.ArgumentParser(description='Replay logged model replies through the response parsers.')
+parser.add_argument('--log', default=QUERY_LOG_PATH)
+parser.add_argument('--since', help='ISO date or timestamp, inclusive')
+parser.add_argument('--show-failures', action='store_true')
+args = parser.parse_args()
+
+results = {'rate': Counter(), 'dedup': Counter(), 'roundup': Counter()}
+
+for record in read_queries(args.log, since=args.since):
+    site = record.get('site')
+    completion = record['completion'] or ''
+    outcome = 'failed'
+
+    if site == 'rate':
+        ratings = parse_ratings(completion)
+        expected = expected_ratings(record['query'])
+        results[site]['rows'] += len(ratings)
+        results[site]['expected rows'] += expected
+        if ratings and len(ratings) >= expected:
+            outcome = 'clean'
+        elif ratings:
+            outcome = 'partial'
+    elif site == 'dedup':
+        try:
+            parse_dedup(completion)
+            outcome = 'clean'
+        except ParseError:
+            pass
+    elif site == 'roundup':
+        try:
+            roundup = parse_roundup(completion, 1000)
+            outcome = 'clean' if roundup['title'] and roundup['body'] else 'partial'
+        except ParseError:
+            pass
+    else:
+        continue
+
+    results[site][outcome] += 1
+    if outcome == 'failed' and args.show_failures:
+        print(f"--- {site} {record['timestamp']}")
+        print(completion)
+
+for site, counts in results.items():
+    total = counts['clean'] + counts['partial'] + counts['failed']
+    line = (f"{site}: {total} replies, {counts['clean']} clean, "
+            f"{counts['partial']} partial, {counts['failed']} failed")
+    if site == 'rate':
+        line += f"; {counts['rows']} of {counts['expected rows']} ratings recovered"
+    print(line)
@@ -0,0 +1,60 @@
+import argparse
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+
+from clusters import CLUSTER_WINDOW
+from querylog import QUERY_LOG_PATH, read_queries
+from store import Store
+
+"""
+Cluster Report
+
+How the topic clusters (clusters.py) and the roundups built from them are
+sizing up: the spread of cluster sizes in the current window, the biggest
+clusters with a few of their headlines, and the roundup prompts sent to the
+model per day (how many, how many stories in each, how many bytes).
+
+Usage: cluster-report.py [--top 10] [--days 7]
+"""
+
+parser = argparse.ArgumentParser(description='Report topic cluster and roundup prompt sizes.')
+parser.add_argument('--top', type=int, default=10, help='how many of the biggest clusters to show')
+parser.add_argument('--days', type=int, default=7, help='days of roundup prompts to show')
+parser.add_argument('--log', default=QUERY_LOG_PATH)
+args = parser.parse_args()
+
+store = Store()
+since = (datetime.now() - timedelta(hours=CLUSTER_WINDOW)).isoformat()
+sizes = store.cluster_sizes(since)
+
+print(f'Clusters in the last {CLUSTER_WINDOW} hours: {len(sizes)}, '
+      f'holding {sum(sizes.values())} stories')
+print()
+print('Size  Clusters')
+for size, clusters in sorted(Counter(sizes.values()).items()):
+    print(f'{size:4}  {clusters}')
+
+print()
+print('Biggest clusters:')
+for cluster, size in sorted(sizes.items(), key=lambda item: -item[1])[:args.top]:
+    entries = store.in_clusters([cluster], ('new', 'avail', 'highlight', 'old', 'queued',
+                                            'post', 'posted', 'dupe'), since)
+    topics = Counter(entry.get('topic') for entry in entries).most_common(1)
+    print(f"  {size} stories, topic {topics[0][0] if topics else None}")
+    for entry in entries[:3]:
+        print(f"    {entry['title']}")
+store.close()
+
+print()
+print('Roundup prompts:')
+print('Day         Prompts  Stories (avg/max)  Bytes (avg/max)')
+days = defaultdict(list)
+log_since = (datetime.now() - timedelta(days=args.days)).date().isoformat()
+for record in read_queries(args.log, site='roundup', since=log_since):
+    days[record['timestamp'][:10]].append((len(record['story_ids']),
+                                           len(record['query'].encode())))
+for day, prompts in sorted(days.items()):
+    stories = [story_count for story_count, size in prompts]
+    sizes = [size for story_count, size in prompts]
+    print(f'{day}  {len(prompts):7}  {sum(stories) / len(stories):8.1f} / {max(stories):<6}'
+          f'  {sum(sizes) / len(sizes):8.0f} / {max(sizes)}')
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+import logging
+import unicodedata
+
+from metrics import count, gauge, timed
+from neardup import NearDupIndex
+
+"""
+Topic Clustering
+
+Groups recent stories into clusters as they're rated, so a roundup starts
+from the stories that are already known to go together instead of asking the
+model to sort through everything from the last day.
+
+A newly rated story joins the cluster of an earlier story with the same
+topic tag (compared case- and accent-insensitively). Failing that, it joins
+the cluster of an earlier story whose headline is close enough, by the same
+shingle similarity neardup.py uses for duplicates but with a lower bar.
+Otherwise it starts a cluster of its own. A cluster is named by the id of
+the story that started it, and stored in the story's `cluster` column.
+
+Only stories fetched in the last CLUSTER_WINDOW hours are considered, so
+long-running topics start fresh clusters each day rather than growing
+without end.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Tuning parameters
+CLUSTER_WINDOW = 24 # in hours
+TITLE_THRESHOLD = 0.35 # headline similarity at or above which it's the same topic
+MAX_ROUNDUP = 8 # most stories to offer the model for one roundup
+
+def topic_key(topic):
+    """The topic tag in a form that compares equal across case and accents."""
+    if not topic:
+        return None
+    topic = unicodedata.normalize('NFKD', topic).casefold()
+    topic = ''.join(char for char in topic if not unicodedata.combining(char))
+    topic = ' '.join(topic.split())
+    if topic in ('', 'none', 'null', 'other', 'misc'):
+        return None
+    return topic
+
+def cluster_stories(store):
+    """Put every rated, unclustered story from the window into a cluster.
+
+    Returns how many stories were clustered.
+    """
+    since = (datetime.now() - timedelta(hours=CLUSTER_WINDOW)).isoformat()
+    recent = store.rated_since(since)
+    if all('cluster' in entry for entry in recent):
+        return 0
+
+    with timed('cluster'):
+        by_topic = {}
+        index = NearDupIndex()
+        changes = []
+        clusters = set()
+
+        for entry in recent:
+            key = topic_key(entry.get('topic'))
+            cluster = entry.get('cluster')
+            if cluster is None:
+                cluster = by_topic.get(key) if key else None
+                if cluster is None:
+                    cluster = index.duplicate(entry['title'], TITLE_THRESHOLD)
+                if cluster is None:
+                    cluster = entry['id']
+                changes.append((entry['id'], {'cluster': cluster}))
+                logger.debug(f"  {cluster}: {entry['title']} [{entry.get('topic')}]")
+
+            clusters.add(cluster)
+            if key:
+                by_topic.setdefault(key, cluster)
+            index.add(cluster, entry['title'])
+
+        store.update_many(changes)
+
+    count('stories_clustered', len(changes))
+    gauge('clusters', len(clusters))
+    logger.info(f'Clustered {len(changes)} stories; {len(clusters)} clusters in the window')
+    return len(changes)
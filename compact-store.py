@@ -0,0 +1,18 @@
+from archive import ARCHIVE_DIR, RETENTION_DAYS, compact
+from ingest import expire_rating_cache
+from store import Store
+
+"""
+Store Compaction
+
+Moves stories older than RETENTION_DAYS out of the live store into the daily
+archive partitions under archive/, and drops expired rating cache entries.
+bot-daemon.py does this itself every COMPACT_INTERVAL; run this from cron if
+you're running rss-fetch.py and dedup-and-post.py by hand instead.
+"""
+
+store = Store()
+moved = compact(store)
+expire_rating_cache(store)
+print(f"Archived {moved} stories older than {RETENTION_DAYS} days into {ARCHIVE_DIR}/")
+store.close()
@@ -0,0 +1,58 @@
+import argparse
+import sys
+
+from posting import UNCONFIRMED
+from store import Store
+
+"""
+Unconfirmed Posts
+
+A post that fails in a way that might have come after it went through (a
+timeout, a 5xx, the console command failing) isn't retried: its stories are
+held as 'unconfirmed' so the same story can't go out twice. Check mbin, then
+settle them here.
+
+  confirm-post.py                     List the unconfirmed stories, a post
+                                      attempt per group.
+  confirm-post.py posted ID [ID ...]  It did go out: the first story is
+                                      marked posted (at the attempt's time),
+                                      the rest of a roundup dupe.
+  confirm-post.py retry ID [ID ...]   It didn't: put the stories back where
+                                      they were, to be posted again.
+"""
+
+parser = argparse.ArgumentParser(description='List or settle posts that may or may not have gone out.')
+parser.add_argument('action', nargs='?', choices=('posted', 'retry'))
+parser.add_argument('ids', nargs='*', metavar='ID')
+args = parser.parse_args()
+
+store = Store()
+held = {entry['id']: entry for entry in store.by_state(UNCONFIRMED, order='post_timestamp')}
+
+if args.action is None:
+    attempt = None
+    for entry in held.values():
+        if entry['post_timestamp'] != attempt:
+            attempt = entry['post_timestamp']
+            print(f"{attempt} ({entry.get('target')})")
+        print(f"  {entry['id']}  {entry['title']}")
+    store.close()
+    sys.exit()
+
+unknown = [id for id in args.ids if id not in held]
+if unknown or not args.ids:
+    parser.error(f"not unconfirmed: {' '.join(unknown)}" if unknown else 'no story ids given')
+
+if args.action == 'posted':
+    state = 'posted'
+    updates = []
+    for id in args.ids:
+        updates.append((id, {'state': state}))
+        state = 'dupe'
+else:
+    updates = [(id, {'state': held[id].get('unconfirmed_from', 'post'), 'post_timestamp': None})
+               for id in args.ids]
+store.update_many(updates)
+for id, fields in updates:
+    print(f"{id}: {fields['state']}")
+store.close()
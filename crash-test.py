@@ -0,0 +1,231 @@
+import argparse
+from datetime import datetime, timedelta
+import gzip
+import json
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import archive
+from feeds import save_feed_state
+from querylog import QUERY_LOG_PATH, log_query, read_queries
+from store import STORE_PATH, Store
+
+"""
+Crash Test
+
+Checks that the store and the plain files survive writers being killed
+mid-operation while other processes read them. Each round starts one
+process per kind of writer, plus a reader, waits for each writer to say
+it's started writing, lets them run for a random moment more, then SIGKILLs
+the writers and checks:
+
+  store      Batches of stories are inserted, then rated, each in one
+             transaction. The database must pass integrity_check, every
+             batch must be all there or not there at all, and all in the
+             same state.
+  feed-state feed-state.json is rewritten over and over; it must always
+             parse.
+  query-log  Records are appended under the lock; every record must read
+             back, bar at most one torn line per kill.
+  archive    Stories are compacted into the archive; every partition must
+             read back to the end.
+  reader     Reads the store the whole time, alongside the writers; it
+             must never see an error (such as "database is locked").
+
+The run fails, too, if any kind of writer got nothing written in all the
+rounds, since then nothing was tested. Everything happens in a scratch
+directory.
+
+Usage: crash-test.py [--rounds 20] [--max-run 0.5]
+"""
+
+BATCH = 50
+WRITERS = ('store', 'feed-state', 'query-log', 'archive')
+READER_ERRORS = 'reader-errors.txt'
+ARCHIVE_STORE = 'archive-test.db'
+
+# What a writer prints once it's set up and about to write
+STARTED = 'started'
+
+def started():
+    print(STARTED, flush=True)
+
+def write_store():
+    store = Store()
+    pid = os.getpid()
+    started()
+    for batch in range(sys.maxsize):
+        feed = f'batch-{pid}-{batch}'
+        now = datetime.now().isoformat()
+        store.insert_many([{'id': f'{feed}-{index}', 'feed': feed, 'title': f'Story {index}',
+                            'link': f'https://crash.example.com/{feed}/{index}',
+                            'timestamp': now, 'state': 'new'}
+                           for index in range(BATCH)])
+        store.update_many([(f'{feed}-{index}', {'state': 'avail', 'rating': 3,
+                                                'category': 'world', 'topic': 'crash'})
+                           for index in range(BATCH)])
+
+def write_feed_state():
+    started()
+    for round in range(sys.maxsize):
+        save_feed_state({f'https://crash.example.com/feed{feed}': {
+                            'etag': f'"{round}-{feed}"', 'ttl': 60, 'padding': 'x' * 2000}
+                         for feed in range(50)})
+
+def write_query_log():
+    started()
+    for round in range(sys.maxsize):
+        log_query('rate', 'prompt ' * random.randint(10, 5000), 'completion', [str(round)])
+
+def write_archive():
+    store = Store(ARCHIVE_STORE)
+    old = (datetime.now() - timedelta(days=archive.RETENTION_DAYS + 1)).isoformat()
+    started()
+    for batch in range(sys.maxsize):
+        feed = f'archive-{os.getpid()}-{batch}'
+        store.insert_many([{'id': f'{feed}-{index}', 'feed': feed, 'title': f'Story {index}',
+                            'timestamp': old, 'state': 'posted'}
+                           for index in range(BATCH)])
+        archive.compact(store, batch_size=BATCH)
+
+def read_store():
+    store = Store()
+    with open(READER_ERRORS, 'a') as errors:
+        while True:
+            try:
+                store.by_state('avail', 'new', limit=100)
+                store.count_posted_since('')
+                store.best_rated('avail')
+            except Exception as e:
+                errors.write(f'{e!r}\n')
+                errors.flush()
+            time.sleep(0.001)
+
+ROLES = {'store': write_store, 'feed-state': write_feed_state,
+         'query-log': write_query_log, 'archive': write_archive, 'reader': read_store}
+
+def spawn(role):
+    return subprocess.Popen([sys.executable, os.path.abspath(__file__), '--role', role],
+                            stdout=subprocess.PIPE, text=True)
+
+def wait_started(writer, role, problems):
+    # Importing and opening the store can take longer than a round, so the
+    # clock only starts once the writer is actually writing
+    if writer.stdout.readline().strip() != STARTED:
+        problems.append(f'{role} writer exited before it started writing')
+
+def check_store(problems):
+    conn = sqlite3.connect(STORE_PATH)
+    result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    if result != 'ok':
+        problems.append(f'store integrity: {result}')
+    for feed, stories, states in conn.execute(
+            "SELECT feed, COUNT(*), COUNT(DISTINCT state) FROM stories "
+            "WHERE feed LIKE 'batch-%' GROUP BY feed"):
+        if stories != BATCH or states != 1:
+            problems.append(f'store: {feed} has {stories} stories in {states} states')
+    conn.close()
+
+def check_feed_state(problems):
+    if not os.path.exists('feed-state.json'):
+        return
+    try:
+        with open('feed-state.json') as infile:
+            json.load(infile)
+    except ValueError as e:
+        problems.append(f'feed-state.json: {e}')
+
+def check_query_log(problems, kills):
+    torn = 0
+    if os.path.exists(QUERY_LOG_PATH):
+        with open(QUERY_LOG_PATH) as infile:
+            for line in infile:
+                try:
+                    json.loads(line)
+                except ValueError:
+                    torn += line.strip() != ''
+    if torn > kills:
+        problems.append(f'query log: {torn} torn lines after {kills} kills')
+    try:
+        sum(1 for record in read_queries())
+    except Exception as e:
+        problems.append(f'query log: {e!r}')
+
+def check_archive(problems):
+    for day in archive.partition_days():
+        try:
+            sum(1 for entry in archive.read_partition(day))
+        except (EOFError, OSError, gzip.BadGzipFile, ValueError) as e:
+            problems.append(f'archive {day}: {e!r}')
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='crash-test-')
+    os.chdir(workdir)
+    Store().close()
+    Store(ARCHIVE_STORE).close()
+
+    reader = spawn('reader')
+    problems = []
+    kills = 0
+    try:
+        for round in range(args.rounds):
+            writers = [spawn(role) for role in WRITERS]
+            for role, writer in zip(WRITERS, writers):
+                wait_started(writer, role, problems)
+            time.sleep(random.uniform(0.05, args.max_run))
+            for writer in writers:
+                writer.send_signal(signal.SIGKILL)
+                writer.wait()
+                writer.stdout.close()
+            kills += 1
+
+            check_store(problems)
+            check_feed_state(problems)
+            check_query_log(problems, kills)
+            check_archive(problems)
+            print(f'Round {round + 1}: {len(problems)} problems so far', file=sys.stderr)
+    finally:
+        reader.terminate()
+        reader.wait()
+
+    if os.path.exists(READER_ERRORS):
+        with open(READER_ERRORS) as infile:
+            problems.extend(f'reader: {line.strip()}' for line in infile)
+
+    store = Store()
+    batches = len({entry['feed'] for entry in store.by_state('avail', 'new')})
+    store.close()
+    records = sum(1 for record in read_queries())
+    partitions = len(archive.partition_days())
+    print(f'{args.rounds} rounds, {batches} store batches written, '
+          f'{records} query log records, '
+          f'{partitions} archive partitions; working files in {workdir}')
+    written = {'store': batches, 'feed-state': os.path.exists('feed-state.json'),
+               'query-log': records, 'archive': partitions}
+    problems.extend(f'{role}: nothing written in {args.rounds} rounds'
+                    for role, total in written.items() if not total)
+    for problem in problems:
+        print(problem)
+    return not problems
+
+def main():
+    parser = argparse.ArgumentParser(description='Kill store and file writers mid-write and check what they leave.')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--max-run', type=float, default=0.5,
+                        help='longest the writers run before being killed, in seconds')
+    parser.add_argument('--role', choices=sorted(ROLES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.role:
+        ROLES[args.role]()
+        return
+    if not run(args):
+        sys.exit(1)
+
+main()
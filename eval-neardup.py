@@ -0,0 +1,81 @@
+import argparse
+import re
+
+from neardup import DUPE_THRESHOLD, TOP_K, NearDupIndex
+from querylog import QUERY_LOG_PATH, read_queries
+from responses import ParseError, parse_dedup
+
+"""
+Near-Duplicate Evaluation
+
+Replays the duplicate checks in the query log against the local
+near-duplicate index, and compares with what the model said. For each
+threshold it reports how many of the model's "exact duplicate" (2) answers
+the index would have caught by itself, and how many it would have wrongly
+thrown out. It also reports how often the prior post the model pointed at
+(for 1 and 2 answers) falls inside the top-k the trimmed prompt would show.
+"""
+
+def read_dupe_checks(path):
+    """Yield (prior titles, candidate title, dupe, idx) for each logged check."""
+    for record in read_queries(path, site='dedup'):
+        query = record['query']
+        if "to detect duplication among stories" not in query:
+            continue
+
+        # Older prompts had the list before the instructions, newer ones
+        # after; either way it's the unindented "n: title" lines
+        head, _, tail = query.partition("The story we're classifying is:\n")
+        priors = [match.group(1) for match in re.finditer(r'^\d+: (.*)$', head, re.M)]
+        candidate = tail.split("\n", 1)[0]
+
+        # Read the answer the way posting.py does
+        try:
+            dupe, idx, us_only = parse_dedup(record['completion'])
+        except ParseError:
+            continue
+
+        yield priors, candidate, dupe, idx
+
+parser = argparse.ArgumentParser(description='Replay logged duplicate checks against the local near-duplicate index.')
+parser.add_argument('--log', default=QUERY_LOG_PATH)
+parser.add_argument('--top-k', type=int, default=TOP_K)
+parser.add_argument('--tfidf', action='store_true', help='rank with TF-IDF cosine (needs numpy)')
+parser.add_argument('--thresholds', default=f'0.5,0.6,{DUPE_THRESHOLD},0.8,0.9')
+args = parser.parse_args()
+
+thresholds = [float(value) for value in args.thresholds.split(',')]
+caught = {threshold: 0 for threshold in thresholds}
+false_dupes = {threshold: 0 for threshold in thresholds}
+checks = model_dupes = pointed = in_top_k = 0
+
+for priors, candidate, dupe, idx in read_dupe_checks(args.log):
+    index = NearDupIndex(use_tfidf=args.tfidf)
+    for position, title in enumerate(priors):
+        index.add(position, title)
+
+    checks += 1
+    if dupe == 2:
+        model_dupes += 1
+
+    best = index.closest(candidate, len(priors))
+    best_score = best[0][0] if best else 0.0
+    for threshold in thresholds:
+        if best_score >= threshold:
+            if dupe == 2:
+                caught[threshold] += 1
+            else:
+                false_dupes[threshold] += 1
+
+    if idx is not None and idx < len(priors):
+        pointed += 1
+        if idx in [key for score, key in best[:args.top_k]]:
+            in_top_k += 1
+
+print(f'{checks} duplicate checks, {model_dupes} judged exact duplicates by the model')
+for threshold in thresholds:
+    print(f'  threshold {threshold:.2f}: caught {caught[threshold]}/{model_dupes}, '
+          f'false duplicates {false_dupes[threshold]}')
+if pointed:
+    print(f'Prior post the model pointed at is in the top {args.top_k}: '
+          f'{in_top_k}/{pointed} ({100 * in_top_k / pointed:.0f}%)')
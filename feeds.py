@@ -0,0 +1,238 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import defaultdict
+import html
+import json
+import logging
+import os
+import re
+import threading
+from urllib.parse import urlsplit
+
+import feedparser
+import requests
+
+from locks import replace_file
+from metrics import count, timed
+
+"""
+Feed Fetching
+
+Fetches the RSS feeds concurrently, with a cap on how many requests go to any
+one host at a time. The ETag / Last-Modified validators for each feed are kept
+in feed-state.json and sent back as a conditional GET, so a feed that hasn't
+changed comes back as a 304 and never gets parsed. The feed's own polling
+hints (<ttl>, <skipHours>) are kept alongside them, for the poll scheduler.
+
+Given the ids already seen in each feed, a changed feed is first scanned for
+its items' ids, and items already seen are cut out before feedparser gets
+it; if nothing's new, it isn't parsed at all. The scan is a cheap regex pass
+over the raw XML, so where it gets an id wrong the item is only parsed (and
+looked up in the store) when it didn't need to be.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Path to the per-feed HTTP validator state
+FEED_STATE_PATH = 'feed-state.json'
+
+# Tuning parameters
+FETCH_WORKERS = 8
+MAX_REQUESTS_PER_HOST = 2
+FETCH_TIMEOUT = 20 # in seconds
+
+USER_AGENT = 'newsbot/1.0 (+feedparser)'
+
+# feedparser doesn't pick up <skipHours>, so it's read from the raw feed
+SKIP_HOURS = re.compile(rb'<skipHours>(.*?)</skipHours>', re.IGNORECASE | re.DOTALL)
+HOUR = re.compile(rb'<hour>\s*(\d+)\s*</hour>', re.IGNORECASE)
+
+# For scanning item ids without parsing the feed
+ITEM = re.compile(rb'<(item|entry)\b.*?</\1\s*>', re.IGNORECASE | re.DOTALL)
+ITEM_ID = re.compile(rb'<(guid|id)\b[^>]*>(.*?)</\1\s*>', re.IGNORECASE | re.DOTALL)
+ITEM_LINK = re.compile(rb'<link\b[^>]*?(?:href="([^"]*)"[^>]*>|>(.*?)</link\s*>)',
+                       re.IGNORECASE | re.DOTALL)
+CDATA = re.compile(r'^<!\[CDATA\[(.*)\]\]>$', re.DOTALL)
+
+def read_feed_list(file_path):
+    """Read the feeds file. Returns a list of (url, poll interval in minutes).
+
+    Each line is a URL, optionally followed by how often to poll it; the
+    interval is None where it isn't given.
+    """
+    if not os.path.exists(file_path):
+        raise Exception("RSS feeds file not found.")
+
+    feeds = []
+    with open(file_path, 'r') as file:
+        for line in file.readlines():
+            fields = line.split()
+            if not fields:
+                continue
+            interval = float(fields[1]) if len(fields) > 1 else None
+            feeds.append((fields[0], interval))
+    return feeds
+
+def read_feed_urls(file_path):
+    return [url for url, interval in read_feed_list(file_path)]
+
+def load_feed_state(file_path=FEED_STATE_PATH):
+    if not os.path.exists(file_path):
+        return {}
+
+    try:
+        with open(file_path) as infile:
+            return json.load(infile)
+    except json.JSONDecodeError:
+        logger.info("Feed state file unreadable; starting fresh.")
+        return {}
+
+def save_feed_state(feed_state, file_path=FEED_STATE_PATH):
+    replace_file(file_path, json.dumps(feed_state, indent=1))
+
+def make_session():
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=FETCH_WORKERS,
+                                            pool_maxsize=FETCH_WORKERS)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers['User-Agent'] = USER_AGENT
+    return session
+
+def feed_hints(content, feed):
+    """The feed's polling hints: ttl in minutes, and skip_hours (GMT)."""
+    hints = {}
+    try:
+        hints['ttl'] = int(feed.feed.get('ttl'))
+    except (TypeError, ValueError):
+        pass
+
+    match = SKIP_HOURS.search(content)
+    if match:
+        hours = sorted({int(hour) % 24 for hour in HOUR.findall(match.group(1))})
+        if hours:
+            hints['skip_hours'] = hours
+    return hints
+
+def item_id(item):
+    """The id feedparser would give an item (its guid / id, else its link)."""
+    match = ITEM_ID.search(item)
+    if match is None:
+        match = ITEM_LINK.search(item)
+        if match is None:
+            return None
+        value = match.group(1) or match.group(2)
+    else:
+        value = match.group(2)
+    text = value.decode('utf-8', 'replace').strip()
+    text = CDATA.sub(r'\1', text).strip()
+    return html.unescape(text)
+
+def prune_seen(content, seen):
+    """Cut the items whose ids are in `seen` out of a raw feed.
+
+    Returns (content, ids of all the items, how many were kept); content is
+    None if every item was seen already.
+    """
+    items = list(ITEM.finditer(content))
+    if not items:
+        return content, [], 0
+
+    ids = [item_id(item.group()) for item in items]
+    kept = [item.group() for item, id in zip(items, ids) if id is None or id not in seen]
+    if not kept:
+        return None, ids, 0
+    if len(kept) == len(items):
+        return content, ids, len(kept)
+    return (content[:items[0].start()] + b'\n'.join(kept) + content[items[-1].end():],
+            ids, len(kept))
+
+def fetch_feed(session, url, validators, host_limit, timeout=FETCH_TIMEOUT, seen=()):
+    """Fetch and parse one feed, leaving out the items with ids in `seen`.
+
+    Returns (feed, validators, item ids); feed is None if the server said
+    304, in which case the old validators and hints still stand and there
+    are no ids, or if every item has been seen.
+    """
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('modified'):
+        headers['If-Modified-Since'] = validators['modified']
+
+    with host_limit, timed('fetch', feed=url):
+        response = session.get(url, headers=headers, timeout=timeout)
+
+    if response.status_code == 304:
+        count('fetch_not_modified', feed=url)
+        return None, validators, []
+
+    response.raise_for_status()
+
+    new_validators = {}
+    if response.headers.get('ETag'):
+        new_validators['etag'] = response.headers['ETag']
+    if response.headers.get('Last-Modified'):
+        new_validators['modified'] = response.headers['Last-Modified']
+
+    count('fetch_bytes', len(response.content), feed=url)
+    with timed('scan', feed=url):
+        content, ids, kept = prune_seen(response.content, seen)
+    if content is None:
+        # Still need the feed-level hints, which come from the <channel>
+        new_validators.update({key: validators[key] for key in ('ttl', 'skip_hours')
+                               if key in validators})
+        return None, new_validators, ids
+
+    with timed('parse_feed', feed=url):
+        feed = feedparser.parse(content, response_headers=dict(response.headers))
+        new_validators.update(feed_hints(content, feed))
+    count('feed_bytes_parsed', len(content), feed=url)
+    return feed, new_validators, ids
+
+def fetch_feeds(feed_urls, feed_state, session=None,
+                workers=FETCH_WORKERS, per_host=MAX_REQUESTS_PER_HOST,
+                timeout=FETCH_TIMEOUT, seen_ids=None):
+    """Fetch all the feeds in parallel.
+
+    Yields (url, feed, item ids) for every feed that changed, as they finish;
+    feed is None if none of its items are new. seen_ids maps each url to the
+    ids already seen in it. feed_state is updated in place with the new
+    validators; a feed that errors out keeps its old ones.
+    """
+    if session is None:
+        session = make_session()
+    if seen_ids is None:
+        seen_ids = {}
+
+    host_limits = defaultdict(lambda: threading.BoundedSemaphore(per_host))
+    for url in feed_urls:
+        host_limits[urlsplit(url).netloc]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for url in feed_urls:
+            futures[executor.submit(fetch_feed,
+                                    session,
+                                    url,
+                                    feed_state.get(url, {}),
+                                    host_limits[urlsplit(url).netloc],
+                                    timeout,
+                                    seen_ids.get(url, ()))] = url
+
+        for future in as_completed(futures):
+            url = futures[future]
+            try:
+                feed, validators, ids = future.result()
+            except requests.RequestException as e:
+                logger.info(f"Fetch failed for {url}: {e}")
+                count('fetch_errors', feed=url)
+                continue
+
+            feed_state[url] = validators
+
+            if feed is None and not ids:
+                logger.info(f"{url}: not modified")
+                continue
+
+            logger.info(url)
+            yield url, feed, ids
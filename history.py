@@ -0,0 +1,138 @@
+from array import array
+from collections import Counter
+from datetime import datetime
+import sys
+
+"""
+Story History
+
+A compact, column-per-field form of the story history, for the tools that
+read days of it at once (reports, summaries) rather than a cycle's handful
+of stories. Store.history() fills one straight from SQLite.
+
+Compared with a list of story dicts:
+
+  Each field is a column, not a key repeated in every story.
+
+  Fields with few distinct values (feed, channel, state, category, topic,
+  target) are stored as small integer codes in an array, with each value
+  kept once; code 0 means not set.
+
+  Timestamps are epoch seconds in an array, converted once by SQLite at
+  load, so sorting and windowing never parse an ISO string.
+
+  Ratings are a byte each (-1 when not rated). An id that's the same as its
+  link is only kept once.
+
+entry(index) turns a row back into the usual dict, for printing.
+"""
+
+CODED = ('feed', 'channel', 'state', 'category', 'topic', 'target')
+TIMES = ('timestamp', 'post_timestamp')
+
+# The order Store.history() selects the columns in
+COLUMNS = ('id', 'title', 'link') + CODED + ('rating',) + TIMES
+
+def epoch(iso):
+    """Epoch seconds for a stored ISO timestamp; 0 if it's missing."""
+    return int(datetime.fromisoformat(iso).timestamp()) if iso else 0
+
+class StoryHistory:
+    __slots__ = COLUMNS + ('values', 'codes')
+
+    def __init__(self):
+        self.id = []
+        self.title = []
+        self.link = []
+        for name in CODED:
+            setattr(self, name, array('I'))
+        self.rating = array('b')
+        for name in TIMES:
+            setattr(self, name, array('q'))
+        self.values = {name: [None] for name in CODED}
+        self.codes = {name: {None: 0} for name in CODED}
+
+    def __len__(self):
+        return len(self.id)
+
+    def code(self, name, value):
+        codes = self.codes[name]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self.values[name])
+            self.values[name].append(sys.intern(value))
+        return code
+
+    def append(self, id, title, link, feed, channel, state, category, topic, target,
+               rating, timestamp, post_timestamp):
+        """Add one story; timestamps are epoch seconds (or None)."""
+        self.id.append(id)
+        self.title.append(title)
+        self.link.append(id if link == id else link)
+        self.feed.append(self.code('feed', feed))
+        self.channel.append(self.code('channel', channel))
+        self.state.append(self.code('state', state))
+        self.category.append(self.code('category', category))
+        self.topic.append(self.code('topic', topic))
+        self.target.append(self.code('target', target))
+        self.rating.append(-1 if rating is None else rating)
+        self.timestamp.append(timestamp or 0)
+        self.post_timestamp.append(post_timestamp or 0)
+
+    def extend(self, entries):
+        """Add stories from dicts (say, from the archive)."""
+        for entry in entries:
+            self.append(entry['id'], entry.get('title'), entry.get('link'),
+                        *(entry.get(name) for name in CODED), entry.get('rating'),
+                        epoch(entry.get('timestamp')), epoch(entry.get('post_timestamp')))
+
+    def value(self, name, index):
+        """A field of one story, decoded."""
+        column = getattr(self, name)
+        if name in CODED:
+            return self.values[name][column[index]]
+        if name == 'rating':
+            return None if column[index] < 0 else column[index]
+        if name in TIMES:
+            return column[index] or None
+        return column[index]
+
+    def entry(self, index):
+        """One story as a store-style dict, with ISO timestamps."""
+        entry = {}
+        for name in COLUMNS:
+            value = self.value(name, index)
+            if value is None:
+                continue
+            if name in TIMES:
+                value = datetime.fromtimestamp(value).isoformat()
+            entry[name] = value
+        return entry
+
+    def where(self, name, *values, indices=None):
+        """Indices of the stories whose coded field is one of these values."""
+        wanted = {self.codes[name][value] for value in values if value in self.codes[name]}
+        column = getattr(self, name)
+        if indices is None:
+            return [index for index, code in enumerate(column) if code in wanted]
+        return [index for index in indices if column[index] in wanted]
+
+    def between(self, name, start, end, indices=None):
+        """Indices of the stories with a timestamp field in [start, end)."""
+        column = getattr(self, name)
+        if indices is None:
+            indices = range(len(column))
+        return [index for index in indices if start <= column[index] < end]
+
+    def count_by(self, name, indices=None):
+        """Counter of a coded field's values, over all stories or these ones."""
+        column = getattr(self, name)
+        counts = Counter(column if indices is None else (column[index] for index in indices))
+        return Counter({self.values[name][code]: total for code, total in counts.items()})
+
+    def order_by(self, name, indices=None, reverse=False):
+        """Indices sorted on a numeric field (a timestamp or the rating)."""
+        column = getattr(self, name)
+        if indices is None:
+            indices = range(len(column))
+        return sorted(indices, key=column.__getitem__, reverse=reverse)
@@ -0,0 +1,433 @@
+import logging
+from datetime import datetime, timedelta
+import hashlib
+import re
+import unicodedata
+
+from clusters import cluster_stories
+from feeds import fetch_feeds, load_feed_state, read_feed_urls, save_feed_state
+from llm import LLMError
+from metrics import count, gauge
+from prompts import rating_prompt, seed_count
+from querylog import log_query
+from responses import parse_ratings
+from routing import load_targets, route_stories
+from urls import canonical_url
+
+"""
+RSS Feed Fetching and Rating
+
+Fetches the RSS feeds listed in rss-feeds.txt, processes new entries, and
+uses GPT-4 to rate stories based on relevance and newsworthiness, routes
+each to a target community (routing.py), then picks the best one to post
+for each target. New stories are stored in the SQLite story store for
+later processing. Run once by rss-fetch.py, or repeatedly by bot-daemon.py.
+"""
+
+logger = logging.getLogger(__name__)
+
+# States:
+#
+# new -> First seen
+# avail -> We've already seen it but not done anything yet
+# highlight -> This is one of the relevant ones of the current crop
+# old -> Too old to bother with
+# queued -> We want to post this, maybe in a rollup
+# post -> This is one to post
+# posted -> Was already posted
+# dupe -> Was posted, just part of a roundup
+# merged -> Same article as an earlier story (merged_into), from another feed or URL
+
+# Ratings:
+#
+# *****: 20+
+# ****: 6-19
+# ***: 3-5
+# **: 1-2
+# *: 0
+
+# Path to the file containing RSS feed URLs
+FEEDS_FILE_PATH = 'rss-feeds.txt'
+
+# Tuning parameters (the posting window is per target; see routing.py)
+CYCLE_INTERVAL = 10 # in minutes
+
+# Rating is sent off in batches of up to RATING_BATCH_SIZE, all at once. A
+# partial batch is held back only as long as the oldest story in it can wait
+# another cycle and still be rated within RATING_LATENCY_TARGET.
+RATING_BATCH_SIZE = 25
+MAX_RATING_BATCHES = 8
+RATING_LATENCY_TARGET = 20 # in minutes
+
+# How many of the newest stories stay in the running to be picked, per target
+MAX_CANDIDATES = 25
+
+RATING_CACHE_TTL = 48 # in hours
+
+# Stories rated this high skip the pick/post queue and go out as soon as
+# they're rated, if run_cycle was given a way to post them.
+FAST_PATH_RATING = 5
+
+# Ids of the items in each feed as of its last fetch, so a long-running
+# process only parses what's new; one-shot runs start empty and parse it all
+seen_ids = {}
+
+# Items in the changed feeds, how many of those were parsed, and how many
+# were new, from the last fetch
+parse_metrics = {'feeds': 0, 'items': 0, 'parsed': 0, 'new': 0, 'merged': 0}
+
+# Backlog depth and time-to-rating from the last rating pass
+rating_metrics = {'backlog': 0, 'rated': 0, 'batches': 0,
+                  'time_to_rating_avg': 0.0, 'time_to_rating_max': 0.0}
+
+def read_auth_cookie(file_path):
+    try:
+        with open(file_path, 'r') as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        logger.info("Auth cookie file not found.")
+        return None
+
+def title_key(title):
+    """Cache key for a headline: a hash of the title with case, accents,
+    punctuation and spacing flattened out, so the same wire story carried
+    by two feeds lands on the same key."""
+    title = unicodedata.normalize('NFKD', title).casefold()
+    title = ''.join(char for char in title if not unicodedata.combining(char))
+    title = re.sub(r'[^\w\s]', ' ', title)
+    title = ' '.join(title.split())
+    return hashlib.sha1(title.encode('utf-8')).hexdigest()
+
+def expire_rating_cache(store):
+    store.expire_ratings((datetime.now() - timedelta(hours=RATING_CACHE_TTL)).isoformat())
+
+def merge_duplicates(store, entries):
+    """Mark entries that are an article we already have as merged.
+
+    An article matches by the canonical key of its link, against the store
+    and against the other entries. The merged copy is still stored (so its id
+    is known next time), but only the original goes on to be rated and
+    posted; the original's `sources` lists every other feed that carried it.
+    Returns how many were merged.
+    """
+    originals = store.by_canonical({entry['canonical'] for entry in entries
+                                    if entry['canonical']})
+    stored_ids = {original['id'] for original in originals.values()}
+    changed = {}
+    merged = 0
+
+    for entry in entries:
+        key = entry['canonical']
+        original = originals.get(key) if key else None
+        if original is None:
+            if key:
+                originals[key] = entry
+            continue
+
+        logger.info(f"Merged into {original['id']}: {entry['title']}")
+        entry['state'] = 'merged'
+        entry['merged_into'] = original['id']
+        merged += 1
+
+        sources = original.setdefault('sources', [])
+        if entry['feed'] != original['feed'] and all(source['feed'] != entry['feed']
+                                                     for source in sources):
+            sources.append({'feed': entry['feed'],
+                            'channel': entry['channel'],
+                            'link': entry['link']})
+            if original['id'] in stored_ids:
+                changed[original['id']] = {'sources': sources}
+
+    store.update_many(list(changed.items()))
+    return merged
+
+def fetch_and_store_rss_feeds(store, feed_urls=None, feed_state=None, session=None):
+    """Fetch the feeds and store their new entries.
+
+    Returns how many new entries each feed that changed turned up.
+    """
+    if feed_urls is None:
+        feed_urls = read_feed_urls(FEEDS_FILE_PATH)
+    if feed_state is None:
+        feed_state = load_feed_state()
+
+    store.change_state('new', 'avail')
+
+    new_counts = {}
+    parse_metrics.update({'feeds': 0, 'items': 0, 'parsed': 0, 'new': 0, 'merged': 0})
+
+    # Feeds are fetched in parallel; the results are stored here one at a
+    # time, since the DB isn't safe to share between threads.
+    for url, feed, item_ids in fetch_feeds(feed_urls, feed_state, session=session,
+                                           seen_ids=seen_ids):
+        parse_metrics['feeds'] += 1
+        parse_metrics['items'] += len(item_ids)
+        count('feed_items', len(item_ids), feed=url, kind='scanned')
+        if feed is None:
+            logger.info(f'{url}: {len(item_ids)} items, all seen')
+            seen_ids[url] = set(item_ids)
+            continue
+
+        ids = []
+        for entry in feed.entries:
+            try:
+                ids.append(str(entry.id))
+            except AttributeError:
+                ids.append(str(entry.link))
+
+        # Check which entries are already in the database, all at once
+        known_ids = store.known_ids(ids)
+
+        new_entries = []
+        for id, entry in zip(ids, feed.entries):
+            if id not in known_ids:
+                logger.info(entry.title)
+                known_ids.add(id)
+
+                # Add new entry to the database with a timestamp
+                new_entries.append({
+                    'feed': str(url),
+                    'id': id,
+                    'title': entry.title,
+                    'link': entry.link,
+                    'published': entry.published,
+                    'timestamp': datetime.now().isoformat(),
+                    'state': 'new',
+                    'channel': feed.feed.title,
+                    'canonical': canonical_url(entry.link)
+                })
+
+        merged = merge_duplicates(store, new_entries)
+        store.insert_many(new_entries)
+        new_counts[url] = len(new_entries)
+        seen_ids[url] = set(item_ids)
+
+        parse_metrics['parsed'] += len(feed.entries)
+        parse_metrics['new'] += len(new_entries) - merged
+        parse_metrics['merged'] += merged
+        count('feed_items', len(feed.entries), feed=url, kind='parsed')
+        count('feed_items', len(new_entries) - merged, feed=url, kind='new')
+        count('feed_items', merged, feed=url, kind='merged')
+        logger.info(f'{url}: {len(item_ids)} items, {len(feed.entries)} parsed, '
+                    f'{len(new_entries) - merged} new, {merged} merged')
+
+    # Entries older than a week are moved out by the compaction stage
+    # (compact-store.py), not here
+
+    save_feed_state(feed_state)
+
+    return new_counts
+
+def make_batches(stories, size=RATING_BATCH_SIZE):
+    """Split stories into the fewest batches of at most `size`, evenly."""
+    count = -(-len(stories) // size)
+    return [stories[index::count] for index in range(count)]
+
+def minutes_waiting(entry, now):
+    return (now - datetime.fromisoformat(entry['timestamp'])).total_seconds() / 60
+
+def should_rate(stories, now):
+    if not stories:
+        return False
+    if len(stories) >= RATING_BATCH_SIZE:
+        return True
+    oldest = max(minutes_waiting(entry, now) for entry in stories)
+    return oldest + CYCLE_INTERVAL >= RATING_LATENCY_TARGET
+
+def read_ratings(completion, stories):
+    """Turn a rating reply into (updates, cache entries) for this batch."""
+    seed = seed_count()
+    updates = []
+    cached = []
+
+    # Whatever rows parse are kept, even if others in the batch don't
+    for index, rating, category, topic in parse_ratings(completion):
+        if index < seed:
+            logger.info('Relooping')
+            continue
+        if index >= seed + len(stories):
+            logger.info(f"No story {index}; skipping")
+            continue
+
+        logger.info(f"Update {stories[index-seed]['title']}")
+        logger.info(f"  {index} {rating} {category} {topic}")
+
+        updates.append((stories[index-seed]['id'],
+                        {'rating': rating,
+                         'category': category,
+                         'topic': topic,
+                         'state': 'avail'}))
+        cached.append((title_key(stories[index-seed]['title']),
+                       {'rating': rating,
+                        'category': category,
+                        'topic': topic}))
+
+    return updates, cached
+
+def rate_stories(store, client, stories):
+    """Rate stories in parallel batches, and write all the results at once."""
+    stories = stories[:RATING_BATCH_SIZE * MAX_RATING_BATCHES]
+    batches = make_batches(stories)
+
+    pending = []
+    for batch in batches:
+        current_query = rating_prompt(batch)
+        # The whole prompt and reply are in the query log; only wanted here
+        # when debugging
+        logger.debug('--- Query')
+        logger.debug(current_query)
+        pending.append((batch, current_query, client.submit(current_query, 'rate')))
+
+    updates = []
+    cached = []
+    for batch, current_query, future in pending:
+        try:
+            completion = future.result()
+        except LLMError as e:
+            # The rest of the batches still count; these get another go next cycle
+            logger.info(f"Rating failed: {e}")
+            continue
+
+        logger.debug('--- Completion')
+        logger.debug(completion)
+
+        log_query('rate', current_query, completion, [entry['id'] for entry in batch])
+
+        batch_updates, batch_cached = read_ratings(completion, batch)
+        updates += batch_updates
+        cached += batch_cached
+
+    store.update_many(updates)
+    store.cache_ratings(cached, datetime.now().isoformat())
+
+    now = datetime.now()
+    rated_ids = {id for id, fields in updates}
+    waits = [minutes_waiting(entry, now) for entry in stories if entry['id'] in rated_ids]
+    rating_metrics.update({'rated': len(rated_ids),
+                           'batches': len(batches),
+                           'time_to_rating_avg': sum(waits) / len(waits) if waits else 0.0,
+                           'time_to_rating_max': max(waits, default=0.0)})
+    count('stories_rated', len(rated_ids))
+    gauge('time_to_rating_minutes', rating_metrics['time_to_rating_max'], stat='max')
+    logger.info(f"Rated {len(rated_ids)} of {len(stories)} in {len(batches)} batches; "
+                f"time to rating {rating_metrics['time_to_rating_avg']:.1f} min average, "
+                f"{rating_metrics['time_to_rating_max']:.1f} max")
+
+def find_unrated_stories(store):
+    recent_entries = []
+    updates = []
+
+    # The unrated backlog, newest first, as much as we'd rate in one go (and
+    # some over, for the ones the cache or an earlier copy takes care of)
+    unrated = store.unrated(limit=MAX_CANDIDATES + RATING_BATCH_SIZE * MAX_RATING_BATCHES)
+
+    # Anything we've already rated under another feed's copy gets the same
+    # rating; only the rest go to the model.
+    since = (datetime.now() - timedelta(hours=RATING_CACHE_TTL)).isoformat()
+    cache = store.cached_ratings({title_key(entry['title']) for entry in unrated}, since)
+    sent_keys = set()
+
+    for entry in unrated:
+        key = title_key(entry['title'])
+        if key in cache:
+            logger.info(f"Cached: {entry['title']}")
+            updates.append((entry['id'], dict(cache[key], state='avail')))
+        elif key not in sent_keys:
+            # A second copy in the same batch waits for the first one's rating
+            logger.info(f"AHN: {entry['title']}")
+            sent_keys.add(key)
+            recent_entries.append(entry)
+
+    store.update_many(updates)
+
+    rating_metrics['backlog'] = len(recent_entries)
+    gauge('rating_backlog', len(recent_entries))
+    logger.info(f'Rating backlog: {len(recent_entries)}')
+
+    return recent_entries
+
+def retire_candidates(store, targets):
+    """Only the newest MAX_CANDIDATES of each target's stories stay in the
+    running; the rest are old.
+
+    Stories still waiting for a rating haven't been routed, so they're left
+    alone: they stay in the backlog until they're rated, or archived.
+    """
+    for target in targets:
+        retired = store.retire_overflow(('highlight', 'avail', 'new'), MAX_CANDIDATES,
+                                        target.name)
+        if retired:
+            logger.info(f'OLD ({target.name}): {retired}')
+
+def pick_story(store, target, post_count):
+    pick_entry = store.best_rated('new', 'avail', 'highlight', target=target.name)
+
+    if pick_entry is None:
+        logger.info(f'No story found for {target.name}')
+        return
+
+    logger.info(f'--- Best story for {target.name}')
+    logger.info(pick_entry['title'])
+
+    if post_count < target.min_stories or pick_entry['rating'] >= 3:
+        logger.info('Queueing for post')
+        store.update(pick_entry['id'], {'state': 'post'})
+    else:
+        logger.info('Not highly enough rated')
+
+def post_breaking(store, target, post_count, post_now):
+    """Post every candidate at FAST_PATH_RATING or above, up to the target's limit.
+
+    Returns the new post count.
+    """
+    while post_count < target.max_stories:
+        pick_entry = store.best_rated('new', 'avail', 'highlight', target=target.name)
+        if pick_entry is None or pick_entry['rating'] < FAST_PATH_RATING:
+            break
+
+        logger.info(f'--- Breaking story for {target.name}')
+        logger.info(pick_entry['title'])
+
+        # If it can't be posted right now, it waits its turn like any other
+        store.update(pick_entry['id'], {'state': 'post'})
+        if post_now(dict(pick_entry, state='post'), target):
+            post_count += 1
+
+    return post_count
+
+def run_cycle(store, client, feed_urls=None, feed_state=None, session=None,
+              post_now=None, targets=None):
+    if targets is None:
+        targets = load_targets()
+
+    # Fetch new stuff from RSS
+    fetch_and_store_rss_feeds(store, feed_urls, feed_state, session)
+
+    # Rate the backlog, unless it can wait for a fuller batch
+    entries = find_unrated_stories(store)
+    if should_rate(entries, datetime.now()):
+        rate_stories(store, client, entries)
+
+    # Group what's been rated by topic, ready for roundups, and send each
+    # story to the community it's for
+    cluster_stories(store)
+    route_stories(store, targets)
+
+    for target in targets:
+        # Now let's make sure we're not at the target's story hard limit.
+        window_begin = datetime.now() - timedelta(minutes=target.story_window)
+
+        post_count = store.count_posted_since(window_begin.isoformat(), target=target.name)
+        logger.info(f'Post count for {target.name}: {post_count}')
+        if post_now is not None:
+            post_count = post_breaking(store, target, post_count, post_now)
+
+        if post_count >= target.max_stories:
+            logger.info('Too many stories; waiting before posting anything.')
+        elif store.by_state('post', limit=1, target=target.name):
+            logger.info('Post already queued; waiting')
+        else:
+            # Pick out a story to post
+            pick_story(store, target, post_count)
+
+    retire_candidates(store, targets)
@@ -0,0 +1,156 @@
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import random
+import threading
+import time
+
+import openai
+
+from metrics import count, observe
+
+"""
+LLM Client
+
+One shared client for every model call the bot makes. Calls can be made
+directly (complete) or handed to a small thread pool (submit) so several run
+at once; either way no more than `concurrency` are in flight. Rate limits,
+5xx errors, timeouts and dropped connections are retried with exponential
+backoff until the call's deadline runs out.
+
+Each call is tagged with a call site ('rate', 'dedup', 'roundup', ...), and
+tokens, latency, retries and errors are tallied per site. The reply comes
+back as a Completion, a str that also carries the call's token usage, which
+log_query() writes to the query log with it.
+
+To test against a fake completion server, pass base_url (or set
+OPENAI_BASE_URL, which the OpenAI library picks up itself).
+"""
+
+logger = logging.getLogger(__name__)
+
+MODEL = 'gpt-4-1106-preview'
+
+# Tuning parameters
+CONCURRENCY = 4
+CALL_TIMEOUT = 120 # in seconds, per attempt
+DEADLINE = 300 # in seconds, per call including retries
+BACKOFF_BASE = 2 # in seconds
+BACKOFF_MAX = 60 # in seconds
+
+class LLMError(Exception):
+    pass
+
+class Completion(str):
+    """The text of a reply, plus the tokens the call used: a dict of
+    prompt_tokens, cached_tokens and completion_tokens, or None if the server
+    didn't say."""
+    usage = None
+
+def retryable(error):
+    if isinstance(error, (openai.RateLimitError,
+                          openai.APITimeoutError,
+                          openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+class LLMClient:
+    def __init__(self, api_key=None, base_url=None, model=MODEL,
+                 concurrency=CONCURRENCY, timeout=CALL_TIMEOUT):
+        # The library's own retries are turned off; we do our own, with a deadline
+        self.client = openai.OpenAI(api_key=api_key, base_url=base_url,
+                                    timeout=timeout, max_retries=0)
+        self.model = model
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.lock = threading.Lock()
+        self.stats = defaultdict(lambda: {'calls': 0, 'errors': 0, 'retries': 0,
+                                          'prompt_tokens': 0, 'cached_tokens': 0,
+                                          'completion_tokens': 0, 'seconds': 0.0})
+
+    def complete(self, prompt, site, deadline=DEADLINE, json_mode=False):
+        """Send one prompt and return the text of the reply.
+
+        With json_mode the model is held to replying with a single JSON
+        object. Raises LLMError if it can't get an answer before the deadline.
+        """
+        extra = {'response_format': {'type': 'json_object'}} if json_mode else {}
+        count('llm_prompt_bytes', len(prompt.encode()), site=site)
+        give_up = time.monotonic() + deadline
+        attempt = 0
+
+        while True:
+            remaining = give_up - time.monotonic()
+            start = time.monotonic()
+            try:
+                with self.slots:
+                    completion = self.client.chat.completions.create(
+                        messages=[{"role": "user", "content": prompt}],
+                        model=self.model,
+                        timeout=min(self.timeout, max(remaining, 1)),
+                        **extra,
+                    )
+            except openai.OpenAIError as e:
+                self.record(site, time.monotonic() - start, error=True)
+                delay = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * random.uniform(0.5, 1)
+                if not retryable(e) or time.monotonic() + delay > give_up:
+                    raise LLMError(f'{site}: {e}') from e
+                logger.info(f'{site}: {e}; retrying in {delay:.1f}s')
+                self.record(site, 0, retry=True)
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            usage = self.record(site, time.monotonic() - start, completion.usage)
+            # No content (a refusal, say) is an empty reply, for the parsers to reject
+            reply = Completion(completion.choices[0].message.content or '')
+            reply.usage = usage
+            return reply
+
+    def submit(self, prompt, site, deadline=DEADLINE, json_mode=False):
+        """Like complete(), but runs on the pool; returns a Future."""
+        return self.executor.submit(self.complete, prompt, site, deadline, json_mode)
+
+    def record(self, site, seconds, usage=None, error=False, retry=False):
+        """Tally one call (or retry); returns its token usage as a dict."""
+        with self.lock:
+            stats = self.stats[site]
+            if retry:
+                stats['retries'] += 1
+                count('llm_retries', site=site)
+                return
+            observe('llm', seconds, site=site)
+            count('llm_calls', site=site)
+            stats['calls'] += 1
+            stats['seconds'] += seconds
+            if error:
+                stats['errors'] += 1
+                count('llm_errors', site=site)
+            if usage is not None:
+                stats['prompt_tokens'] += usage.prompt_tokens
+                stats['completion_tokens'] += usage.completion_tokens
+                # How much of the prompt the provider served from its cache
+                details = getattr(usage, 'prompt_tokens_details', None)
+                cached = getattr(details, 'cached_tokens', 0) or 0
+                stats['cached_tokens'] += cached
+                count('llm_tokens', usage.prompt_tokens, site=site, kind='prompt')
+                count('llm_tokens', cached, site=site, kind='cached')
+                count('llm_tokens', usage.completion_tokens, site=site, kind='completion')
+                return {'prompt_tokens': usage.prompt_tokens, 'cached_tokens': cached,
+                        'completion_tokens': usage.completion_tokens}
+
+    def report(self):
+        lines = []
+        with self.lock:
+            for site, stats in sorted(self.stats.items()):
+                average = stats['seconds'] / stats['calls'] if stats['calls'] else 0
+                lines.append(f"{site}: {stats['calls']} calls, {stats['errors']} errors, "
+                             f"{stats['retries']} retries, {stats['prompt_tokens']} prompt "
+                             f"({stats['cached_tokens']} cached) + "
+                             f"{stats['completion_tokens']} completion tokens, "
+                             f"{average:.2f}s average")
+        return '\n'.join(lines)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
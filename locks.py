@@ -0,0 +1,80 @@
+from contextlib import contextmanager
+import fcntl
+import os
+import tempfile
+import time
+
+from metrics import observe
+
+"""
+Locks and Atomic Writes
+
+What lets the fetch/rate stage, the post stage and the report tool run at
+the same time, in separate processes, and lets any of them be killed at
+any point without leaving a half-written file behind.
+
+The store itself is SQLite in WAL mode (store.py): readers never block, and
+writes are transactions. On top of that, two stages must not run twice at
+once, since they read, decide and then write: rating and picking (INGEST_LOCK),
+and anything that posts (POSTING_LOCK), so a story can't go out twice.
+Compaction and appending to the query log each have a lock too. They're all
+held with flock() on a <name>.lock file in the working directory; the
+kernel drops the lock if its holder dies, so a crash never leaves one stuck.
+
+Plain files (feed-state.json, the archive partitions) are replaced whole:
+written to a temporary file, synced, then renamed over the old one.
+"""
+
+INGEST_LOCK = 'ingest'
+POSTING_LOCK = 'posting'
+COMPACT_LOCK = 'compact'
+QUERY_LOG_LOCK = 'query-log'
+
+LOCK_TIMEOUT = 300 # in seconds
+LOCK_POLL = 0.1 # in seconds
+
+class LockBusy(Exception):
+    pass
+
+def lock_path(name):
+    return f'{name}.lock'
+
+@contextmanager
+def file_lock(name, timeout=LOCK_TIMEOUT):
+    """Hold the named cross-process lock for the block.
+
+    Raises LockBusy if another process still holds it after `timeout`
+    seconds (0 to not wait at all). Not re-entrant: don't take the same
+    lock again inside the block.
+    """
+    start = time.perf_counter()
+    with open(lock_path(name), 'a') as lockfile:
+        while True:
+            try:
+                fcntl.flock(lockfile, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.perf_counter() - start >= timeout:
+                    raise LockBusy(f'{name} is locked by another process')
+                time.sleep(LOCK_POLL)
+        observe('lock_wait', time.perf_counter() - start, lock=name)
+        try:
+            yield
+        finally:
+            fcntl.flock(lockfile, fcntl.LOCK_UN)
+
+def replace_file(path, data, mode='w'):
+    """Replace the file at `path` with `data`, so readers (and a crash) see
+    either the old contents or the new, never part of either."""
+    directory = os.path.dirname(path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as outfile:
+            outfile.write(data)
+            outfile.flush()
+            os.fsync(outfile.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -0,0 +1,144 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import cProfile
+import io
+import logging
+import os
+import pstats
+import threading
+import time
+
+"""
+Metrics
+
+Per-stage instrumentation for the whole pipeline: how long each stage takes
+(fetching each feed, DB reads and writes, building prompts, model calls,
+parsing replies, posting), and counts of things like bytes fetched, tokens
+and rows written. Everything is kept in memory and written out in the
+Prometheus text format to metrics/<process>.prom, for node_exporter's
+textfile collector (or just for reading).
+
+Stages are timed with `with timed('stage', label=value):`, which also works
+as a decorator; count() and gauge() record the rest. profiled() runs a block
+under cProfile, for the --profile switch.
+"""
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = 'metrics'
+PREFIX = 'newsbot_'
+
+PROFILE_PATH = 'cycle.prof'
+PROFILE_TOP = 30
+
+lock = threading.Lock()
+counters = defaultdict(float)
+gauges = {}
+timings = defaultdict(lambda: [0, 0.0, 0.0]) # count, total, max
+
+def reset():
+    """Forget everything recorded so far."""
+    with lock:
+        counters.clear()
+        gauges.clear()
+        timings.clear()
+
+def label_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+def count(name, value=1, **labels):
+    with lock:
+        counters[name, label_key(labels)] += value
+
+def gauge(name, value, **labels):
+    with lock:
+        gauges[name, label_key(labels)] = value
+
+def observe(stage, seconds, **labels):
+    with lock:
+        timing = timings[stage, label_key(labels)]
+        timing[0] += 1
+        timing[1] += seconds
+        timing[2] = max(timing[2], seconds)
+
+@contextmanager
+def timed(stage, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start, **labels)
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape(value)}"' for name, value in pairs) + '}'
+
+def render():
+    """Everything recorded so far, in the Prometheus text format."""
+    lines = []
+    with lock:
+        for name in sorted({name for name, key in counters}):
+            lines.append(f'# TYPE {PREFIX}{name}_total counter')
+            for (other, key), value in sorted(counters.items()):
+                if other == name:
+                    lines.append(f'{PREFIX}{name}_total{format_labels(key)} {value:g}')
+
+        for name in sorted({name for name, key in gauges}):
+            lines.append(f'# TYPE {PREFIX}{name} gauge')
+            for (other, key), value in sorted(gauges.items()):
+                if other == name:
+                    lines.append(f'{PREFIX}{name}{format_labels(key)} {value:g}')
+
+        if timings:
+            stages = [(format_labels((('stage', stage),) + key), timing)
+                      for (stage, key), timing in sorted(timings.items())]
+            lines.append(f'# TYPE {PREFIX}stage_seconds summary')
+            for labels, (calls, total, longest) in stages:
+                lines.append(f'{PREFIX}stage_seconds_count{labels} {calls}')
+                lines.append(f'{PREFIX}stage_seconds_sum{labels} {total:.6f}')
+            lines.append(f'# TYPE {PREFIX}stage_seconds_max gauge')
+            for labels, (calls, total, longest) in stages:
+                lines.append(f'{PREFIX}stage_seconds_max{labels} {longest:.6f}')
+    return '\n'.join(lines) + '\n'
+
+def write_metrics(process, metrics_dir=METRICS_DIR):
+    """Write metrics/<process>.prom, replacing it whole so readers never see half."""
+    os.makedirs(metrics_dir, exist_ok=True)
+    path = os.path.join(metrics_dir, f'{process}.prom')
+    with open(path + '.tmp', 'w') as outfile:
+        outfile.write(render())
+    os.replace(path + '.tmp', path)
+
+def stage_totals():
+    """{stage: [calls, total seconds]}, summed over labels."""
+    totals = defaultdict(lambda: [0, 0.0])
+    with lock:
+        for (stage, key), (calls, total, longest) in timings.items():
+            totals[stage][0] += calls
+            totals[stage][1] += total
+    return dict(totals)
+
+def summary():
+    """Total time and calls per stage, slowest first, for the log."""
+    totals = stage_totals()
+    return ', '.join(f'{stage} {total:.2f}s/{calls}'
+                     for stage, (calls, total) in sorted(totals.items(),
+                                                         key=lambda item: -item[1][1]))
+
+@contextmanager
+def profiled(path=PROFILE_PATH, top=PROFILE_TOP):
+    """Run the block under cProfile; dump the stats to `path` and log the top."""
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(top)
+        logger.info(f'Profile written to {path}:\n{out.getvalue()}')
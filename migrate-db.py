@@ -0,0 +1,22 @@
+import sys
+
+from querylog import migrate_legacy_log
+from store import Store, TINYDB_PATH, migrate_tinydb
+
+"""
+One-shot migration from the old TinyDB file (rss-feed-data.json) into the
+SQLite story store. Safe to run more than once; stories already in the store
+are skipped. Also converts the old all-queries.json into a segment of the
+append-only query log.
+
+Usage: migrate-db.py [tinydb-json-path]
+"""
+
+json_path = sys.argv[1] if len(sys.argv) > 1 else TINYDB_PATH
+
+store = Store()
+count = migrate_tinydb(store, json_path)
+print(f"Copied {count} stories from {json_path} into {store.path}")
+
+count = migrate_legacy_log()
+print(f"Converted {count} logged queries")
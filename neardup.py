@@ -0,0 +1,142 @@
+from collections import defaultdict
+import hashlib
+import math
+import re
+import unicodedata
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+Near-Duplicate Detection
+
+A small local index over headlines, so post_story can settle exact and
+near-exact duplicates itself, and only show the model the handful of prior
+posts that are actually close to the story it's checking.
+
+Titles are reduced to word shingles (single words plus adjacent pairs) and
+compared by Jaccard similarity. MinHash signatures bucketed with LSH pick out
+the candidates, so a query doesn't have to be compared against every title.
+If numpy is installed, TF-IDF cosine similarity can be used instead.
+"""
+
+# Tuning parameters
+DUPE_THRESHOLD = 0.7 # similarity at or above which it's the same story
+TOP_K = 8 # how many close prior posts to show the model
+NUM_HASHES = 64
+BANDS = 32 # rows per band is NUM_HASHES / BANDS
+
+STOPWORDS = {'a', 'an', 'the', 'of', 'in', 'on', 'at', 'to', 'for', 'and',
+             'or', 'as', 'by', 'with', 'from', 'is', 'are', 'was', 'be',
+             'after', 'over', 'its', 'it', 'that', 'this'}
+
+def tokenize(title):
+    title = unicodedata.normalize('NFKD', title).casefold()
+    title = ''.join(char for char in title if not unicodedata.combining(char))
+    return [word for word in re.findall(r'\w+', title) if word not in STOPWORDS]
+
+def shingles(title):
+    words = tokenize(title)
+    return set(words) | {f'{first} {second}' for first, second in zip(words, words[1:])}
+
+def jaccard(first, second):
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+def minhash(shingle_set):
+    signature = []
+    for seed in range(NUM_HASHES):
+        signature.append(min((int.from_bytes(hashlib.blake2b(
+            shingle.encode('utf-8'), digest_size=8, salt=seed.to_bytes(8, 'little')
+        ).digest(), 'little') for shingle in shingle_set), default=0))
+    return signature
+
+def bands(signature):
+    rows = NUM_HASHES // BANDS
+    return [(band, tuple(signature[band*rows:(band+1)*rows])) for band in range(BANDS)]
+
+class NearDupIndex:
+    def __init__(self, use_tfidf=False):
+        if use_tfidf and numpy is None:
+            raise Exception("TF-IDF similarity needs numpy installed.")
+        self.use_tfidf = use_tfidf
+        self.keys = []
+        self.titles = []
+        self.shingles = []
+        self.buckets = defaultdict(set)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, key, title):
+        position = len(self.keys)
+        self.keys.append(key)
+        self.titles.append(title)
+        self.shingles.append(shingles(title))
+        for band in bands(minhash(self.shingles[-1])):
+            self.buckets[band].add(position)
+
+    def candidates(self, title):
+        """Positions that share at least one LSH bucket with this title."""
+        found = set()
+        for band in bands(minhash(shingles(title))):
+            found |= self.buckets.get(band, set())
+        return found
+
+    def scores(self, title):
+        """Similarity of this title against every indexed title."""
+        if self.use_tfidf:
+            return tfidf_scores(title, self.titles)
+        query = shingles(title)
+        return [jaccard(query, other) for other in self.shingles]
+
+    def closest(self, title, k=TOP_K):
+        """The k most similar indexed titles, as (score, key), best first."""
+        scores = self.scores(title)
+        ranked = sorted(range(len(scores)), key=lambda position: -scores[position])
+        return [(scores[position], self.keys[position]) for position in ranked[:k]]
+
+    def duplicate(self, title, threshold=DUPE_THRESHOLD):
+        """The key of an indexed title this one duplicates, or None.
+
+        Only LSH candidates are checked, so this stays cheap however many
+        titles are indexed.
+        """
+        query = shingles(title)
+        best_score, best_key = 0.0, None
+        for position in self.candidates(title):
+            score = jaccard(query, self.shingles[position])
+            if score > best_score:
+                best_score, best_key = score, self.keys[position]
+        if best_score >= threshold:
+            return best_key
+        return None
+
+def tfidf_scores(title, titles):
+    documents = [tokenize(other) for other in titles]
+    vocabulary = {}
+    for words in documents:
+        for word in words:
+            vocabulary.setdefault(word, len(vocabulary))
+
+    counts = numpy.zeros((len(documents), len(vocabulary)))
+    for row, words in enumerate(documents):
+        for word in words:
+            counts[row, vocabulary[word]] += 1
+
+    document_frequency = (counts > 0).sum(axis=0)
+    idf = numpy.log((1 + len(documents)) / (1 + document_frequency)) + 1
+
+    query = numpy.zeros(len(vocabulary))
+    for word in tokenize(title):
+        if word in vocabulary:
+            query[vocabulary[word]] += 1
+
+    matrix = counts * idf
+    query = query * idf
+    norms = numpy.linalg.norm(matrix, axis=1) * numpy.linalg.norm(query)
+    norms[norms == 0] = math.inf
+    return list(matrix @ query / norms)
@@ -0,0 +1,109 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+import random
+
+"""
+Feed Poll Scheduling
+
+Decides when each feed is next fetched, for bot-daemon.py. A feed with an
+interval given in rss-feeds.txt is polled on exactly that interval. Every
+other feed's interval is learned from how many new stories it has turned up
+lately (from the store), aiming for about NEW_PER_POLL new stories a poll,
+between MIN_POLL_INTERVAL and MAX_POLL_INTERVAL. So a feed with ten stories
+an hour is polled every few minutes, and one with two a day only a couple of
+times an hour.
+
+On top of that:
+
+  Each poll that turns up nothing new (including a 304) backs the feed off
+  by BACKOFF_FACTOR, up to MAX_POLL_INTERVAL; the next new story resets it.
+
+  A feed's <ttl> is a floor on its interval, and polls are never scheduled
+  in its <skipHours>.
+
+  Every interval gets a little jitter, so feeds don't bunch up.
+"""
+
+# Tuning parameters
+DEFAULT_POLL_INTERVAL = 10 # in minutes, until there's something to learn from
+MIN_POLL_INTERVAL = 5 # in minutes
+MAX_POLL_INTERVAL = 120 # in minutes
+NEW_PER_POLL = 1
+RATE_WINDOW = 72 # in hours
+BACKOFF_FACTOR = 1.5
+MAX_BACKOFF_STEPS = 8
+JITTER = 0.1
+
+def clamp(minutes):
+    return max(MIN_POLL_INTERVAL, min(MAX_POLL_INTERVAL, minutes))
+
+def after_skip_hours(when, skip_hours):
+    """The first time at or after `when` (a Unix time) outside the skip hours."""
+    if not skip_hours or len(set(skip_hours)) >= 24:
+        return when
+    moment = datetime.fromtimestamp(when, timezone.utc)
+    while moment.hour in skip_hours:
+        moment = moment.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+    return moment.timestamp()
+
+class PollScheduler:
+    def __init__(self, feeds):
+        """feeds is a list of (url, fixed interval in minutes or None)."""
+        self.fixed = {}
+        self.learned = {}
+        self.empty_polls = defaultdict(int)
+        self.next_poll = {}
+        self.set_feeds(feeds)
+
+    def set_feeds(self, feeds):
+        """Change the feed list; feeds that are still in it keep their schedule."""
+        self.fixed = dict(feeds)
+        for table in (self.learned, self.empty_polls, self.next_poll):
+            for url in [url for url in table if url not in self.fixed]:
+                del table[url]
+
+    def learn(self, store):
+        """Set each feed's base interval from its recent story count."""
+        since = (datetime.now() - timedelta(hours=RATE_WINDOW)).isoformat()
+        counts = store.count_by_feed(since)
+        for url in self.fixed:
+            per_hour = counts.get(url, 0) / RATE_WINDOW
+            self.learned[url] = clamp(60 * NEW_PER_POLL / per_hour
+                                      if per_hour else MAX_POLL_INTERVAL)
+
+    def interval(self, url, hints):
+        """Minutes until this feed's next poll, before jitter."""
+        if self.fixed.get(url) is not None:
+            return self.fixed[url]
+        minutes = self.learned.get(url, DEFAULT_POLL_INTERVAL)
+        minutes = min(MAX_POLL_INTERVAL, minutes * BACKOFF_FACTOR ** self.empty_polls[url])
+        if hints.get('ttl'):
+            minutes = max(minutes, min(hints['ttl'], MAX_POLL_INTERVAL))
+        return minutes
+
+    def due(self, now):
+        return [url for url in self.fixed if self.next_poll.get(url, 0) <= now]
+
+    def record(self, urls, new_counts, feed_state, now):
+        """Schedule the next poll for feeds just fetched.
+
+        new_counts is what fetch_and_store_rss_feeds returned; a feed missing
+        from it was unchanged or failed, which counts as an empty poll.
+        """
+        for url in urls:
+            if new_counts.get(url):
+                self.empty_polls[url] = 0
+            else:
+                self.empty_polls[url] = min(self.empty_polls[url] + 1, MAX_BACKOFF_STEPS)
+
+            hints = feed_state.get(url, {})
+            seconds = self.interval(url, hints) * 60 * random.uniform(1 - JITTER, 1 + JITTER)
+            self.next_poll[url] = after_skip_hours(now + seconds, hints.get('skip_hours'))
+
+    def report(self, feed_state):
+        """How many feeds are on each interval, to the nearest minute."""
+        intervals = defaultdict(int)
+        for url in self.fixed:
+            intervals[round(self.interval(url, feed_state.get(url, {})))] += 1
+        return ', '.join(f'{count} every {minutes} min'
+                         for minutes, count in sorted(intervals.items()))
@@ -0,0 +1,180 @@
+import json
+import logging
+import os
+import random
+import subprocess
+import time
+
+import requests
+from urllib3.exceptions import NewConnectionError
+
+from metrics import count, timed
+
+"""
+Post Submission
+
+The last step of posting: getting a story onto mbin. A poster has one
+method, post(user, magazine, title, url=None, body=None), which either
+succeeds or raises PostError; a link post has a url, a roundup has a body.
+
+Two backends:
+
+  SubprocessPoster runs submit-post.sh (mbin's console command) once per post,
+  with a timeout, and checks its exit status.
+
+  HttpPoster talks to mbin's API over one pooled keep-alive session, so a
+  post is a single request instead of a shell plus a PHP boot.
+
+Creating a post isn't idempotent, so both retry, with exponential backoff,
+only failures where the post can't have gone through: the connection
+refused or timing out before it was made, the command not starting, an HTTP
+429, or a 503 (which mbin sends before doing anything). A timeout, any
+other 5xx or the command failing might have come after the post was made;
+those raise at once, marked maybe_posted, and posting.py holds the story
+as 'unconfirmed' for someone to check (confirm-post.py) before it's tried
+again. Which backend is used comes
+from poster.json, if it exists:
+
+  {"backend": "http", "base_url": "https://mbin.example",
+   "token_path": "mbin-token", "magazines": {"usnews": 12, "worldnews": 13}}
+
+Otherwise it's the subprocess backend. stub-mbin.py serves a fake API to
+test the HTTP backend against.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Path to the poster configuration
+POSTER_CONFIG_PATH = 'poster.json'
+
+SUBMIT_COMMAND = ['./submit-post.sh']
+
+# Tuning parameters
+POST_TIMEOUT = 60 # in seconds, per attempt
+POST_RETRIES = 2
+BACKOFF_BASE = 2 # in seconds
+POOL_SIZE = 2
+
+class PostError(Exception):
+    def __init__(self, message, retryable=True, maybe_posted=False):
+        super().__init__(message)
+        self.retryable = retryable and not maybe_posted
+        self.maybe_posted = maybe_posted
+
+def never_sent(error):
+    """Whether a requests error happened before the request got to the server."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+def with_retries(attempt_post, retries, what):
+    """Call attempt_post until it returns, or it's failed retries + 1 times."""
+    for attempt in range(retries + 1):
+        try:
+            return attempt_post()
+        except PostError as e:
+            count('post_errors')
+            if not e.retryable or attempt == retries:
+                raise
+            delay = BACKOFF_BASE * 2 ** attempt * random.uniform(0.5, 1)
+            logger.info(f'{what}: {e}; retrying in {delay:.1f}s')
+            time.sleep(delay)
+
+class SubprocessPoster:
+    def __init__(self, command=SUBMIT_COMMAND, timeout=POST_TIMEOUT, retries=POST_RETRIES):
+        self.command = list(command)
+        self.timeout = timeout
+        self.retries = retries
+
+    def post(self, user, magazine, title, url=None, body=None):
+        args = ['--url=' + url] if url is not None else ['--body=' + body]
+        args += [user, magazine, title]
+
+        def attempt_post():
+            try:
+                result = subprocess.run([*self.command, *args], capture_output=True,
+                                        text=True, timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                raise PostError(f'timed out after {self.timeout}s', maybe_posted=True)
+            except OSError as e:
+                # Never started
+                raise PostError(str(e))
+            if result.returncode != 0:
+                # The console command doesn't say how far it got
+                raise PostError(f'exit status {result.returncode}: '
+                                f'{result.stderr.strip() or result.stdout.strip()}',
+                                maybe_posted=True)
+            return result.stdout
+
+        with timed('post', backend='subprocess'):
+            return with_retries(attempt_post, self.retries, 'Post')
+
+    def close(self):
+        pass
+
+class HttpPoster:
+    def __init__(self, base_url, token, magazines=None, timeout=POST_TIMEOUT,
+                 retries=POST_RETRIES):
+        self.base_url = base_url.rstrip('/')
+        self.magazines = magazines or {}
+        self.timeout = timeout
+        self.retries = retries
+
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Authorization'] = f'Bearer {token}'
+
+    def post(self, user, magazine, title, url=None, body=None):
+        # The API token already says who's posting, so user isn't needed here
+        magazine_id = self.magazines.get(magazine, magazine)
+        if url is not None:
+            endpoint = f'{self.base_url}/api/magazine/{magazine_id}/link'
+            payload = {'title': title, 'url': url}
+        else:
+            endpoint = f'{self.base_url}/api/magazine/{magazine_id}/article'
+            payload = {'title': title, 'body': body}
+        payload.update({'lang': 'en', 'isOc': False, 'isAdult': False, 'tags': []})
+
+        def attempt_post():
+            try:
+                response = self.session.post(endpoint, json=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                raise PostError(str(e), maybe_posted=not never_sent(e))
+            if response.status_code in (429, 503):
+                raise PostError(f'HTTP {response.status_code}')
+            if response.status_code >= 500:
+                raise PostError(f'HTTP {response.status_code}', maybe_posted=True)
+            if response.status_code >= 400:
+                # Our fault; trying again won't help
+                raise PostError(f'HTTP {response.status_code}: {response.text[:200]}',
+                                retryable=False)
+            return response.text
+
+        with timed('post', backend='http'):
+            return with_retries(attempt_post, self.retries, 'Post')
+
+    def close(self):
+        self.session.close()
+
+def make_poster(config_path=POSTER_CONFIG_PATH):
+    if not os.path.exists(config_path):
+        return SubprocessPoster()
+
+    with open(config_path) as infile:
+        config = json.load(infile)
+
+    backend = config.get('backend', 'subprocess')
+    if backend == 'subprocess':
+        return SubprocessPoster(config.get('command', SUBMIT_COMMAND),
+                                config.get('timeout', POST_TIMEOUT),
+                                config.get('retries', POST_RETRIES))
+    if backend == 'http':
+        with open(config.get('token_path', 'mbin-token')) as infile:
+            token = infile.read().strip()
+        return HttpPoster(config['base_url'], token, config.get('magazines'),
+                          config.get('timeout', POST_TIMEOUT),
+                          config.get('retries', POST_RETRIES))
+    raise Exception(f'Unknown poster backend: {backend}')
@@ -0,0 +1,357 @@
+from datetime import datetime, timedelta
+
+from clusters import CLUSTER_WINDOW, MAX_ROUNDUP
+from llm import LLMError
+from metrics import count, gauge
+from neardup import NearDupIndex
+from posters import PostError
+from prompts import dedup_prompt, roundup_prompt
+from querylog import log_query
+from responses import ParseError, parse_dedup, parse_roundup
+from routing import load_targets
+
+"""
+Story Deduplication and Posting
+
+Analyzes the rated stories from our database, checks for duplicates,
+and determines the best stories to post. It handles both individual posts and
+roundups of related stories, posting them to a link aggregator community.
+A roundup is built from the stories that came due plus the best of the
+others in their topic clusters (clusters.py), up to MAX_ROUNDUP. Each target
+community (routing.py) is deduplicated, queued and posted separately.
+"""
+
+QUEUE_DELAY = 8 # in hours
+
+# How many times the dedup check's reply can fail to parse before the story
+# is given up on
+MAX_DEDUP_FAILURES = 3
+
+# A post that failed in a way that might have come after it went through
+# (posters.py) isn't tried again: its stories wait in this state until
+# someone has checked mbin and settled them with confirm-post.py
+UNCONFIRMED = 'unconfirmed'
+
+# States a story can be in and still join a roundup
+ROUNDUP_STATES = ('new', 'avail', 'highlight', 'queued')
+
+def also_at(entry):
+    """Credit for the other outlets that carried the same article."""
+    sources = entry.get('sources')
+    if not sources:
+        return ''
+    return ' (also ' + ', '.join(f"[{source.get('channel') or 'Link'}]({source['link']})"
+                                 for source in sources) + ')'
+
+def detect_to_post(entry, post_time):
+    """Seconds from when we first fetched the story to when it went out."""
+    return round((post_time - datetime.fromisoformat(entry['timestamp'])).total_seconds())
+
+def read_auth_cookie(file_path):
+    try:
+        with open(file_path, 'r') as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        print("Auth cookie file not found.")
+        return None
+
+# Returns true if you found something
+def try_to_dequeue(store, client, poster, target):
+    time_threshold = (datetime.now() - timedelta(hours=QUEUE_DELAY)).isoformat()
+    for entry in store.queued_before(time_threshold, limit=1, target=target.name):
+        dequeue_story(store, client, poster, entry, target)
+        return True
+    return False
+
+
+def dequeue_story(store, client, poster, queue_entry, target):
+    print(f"Dequeueing old story for {target.name}: {queue_entry['title']}")
+
+    if 'schedule_timestamp' in queue_entry:
+        schedule_timestamp = queue_entry['schedule_timestamp']
+    else:
+        schedule_timestamp = queue_entry['timestamp']
+
+    queued_entries = []
+
+    category = {'usnews': 0, 'worldnews': 0}
+
+    for entry in store.queued_with_schedule(schedule_timestamp, target=target.name):
+        print(f"  {entry['title']}")
+        print(f"    {entry['id']}")
+        queued_entries.append(entry)
+
+        if 'category' in entry:
+            category[entry['category']] += 1
+
+    print(f"Categories: {category}")
+    
+    if category['worldnews'] > category['usnews']:
+        category = 'worldnews'
+    else:
+        category = 'usnews'
+
+    # The rest of the candidates come from the same topic clusters
+    time_threshold = (datetime.now() - timedelta(hours=CLUSTER_WINDOW)).isoformat()
+    queued_ids = {entry['id'] for entry in queued_entries}
+    clusters = {entry['cluster'] for entry in queued_entries if 'cluster' in entry}
+
+    others = []
+    if clusters:
+        others = [entry for entry in store.in_clusters(clusters, ROUNDUP_STATES, time_threshold)
+                  if entry['id'] not in queued_ids and entry.get('target') == target.name]
+        others.sort(key=lambda entry: -entry.get('rating', 0))
+
+    print()
+    print(f'And checking {len(others)} other entries in {len(clusters)} clusters:')
+
+    for entry in others[:max(0, MAX_ROUNDUP - len(queued_entries))]:
+        print(f"  {entry['title']}")
+        print(f"    {entry['id']}")
+        print(f"    {entry['category']}" if 'category' in entry else '')
+        queued_entries.append(entry)
+
+    current_query = roundup_prompt(queued_entries)
+    print(f'Roundup of {len(queued_entries)} stories, {len(current_query.encode())} byte prompt')
+    gauge('roundup_stories', len(queued_entries))
+    gauge('roundup_prompt_bytes', len(current_query.encode()))
+
+    print('--- Query')
+    print(current_query)
+    print()
+
+    try:
+        result_str = client.complete(current_query, 'roundup', json_mode=True)
+    except LLMError as e:
+        print(f'Roundup failed: {e}')
+        return
+
+    log_query('roundup', current_query, result_str,
+              [entry['id'] for entry in queued_entries])
+
+    print('--- Result')
+    print(result_str)
+
+    try:
+        json_data = parse_roundup(result_str, len(queued_entries))
+    except ParseError as e:
+        # Post just the story that came due; the others can wait their turn
+        print(f'Roundup unparseable ({e}); posting it alone')
+        json_data = {'ids': [0], 'title': None, 'body': None}
+
+    if json_data['title'] is None:
+        json_data['title'] = queued_entries[0]['title']
+    if json_data['body'] is None:
+        json_data['body'] = '\n'.join(
+            f"* {queued_entries[id].get('channel', 'Link')} - "
+            f"[{queued_entries[id]['title']}]({queued_entries[id]['link']})"
+            + also_at(queued_entries[id])
+            for id in json_data['ids'])
+
+    try:
+        if len(json_data['ids']) > 1:
+            print('-- Multi post')
+            body = ('Here are some recent stories on the topic:\n\n'
+                + json_data['body']
+                + '\n\nVisit any one for the full story.')
+
+            title = json_data['title']
+            #if not re.search(r':', title):
+            #    title = 'Roundup: ' + title
+            submit_post(poster, target.user, target.magazine_for(category), title, body=body)
+
+        else:
+            print('-- Single post')
+            entry = queued_entries[0]
+            submit_post(poster, target.user, target.magazine_for(category),
+                        entry['title'], url=entry['link'])
+    except PostError as e:
+        if e.maybe_posted:
+            hold_unconfirmed(store, [queued_entries[id] for id in json_data['ids']], target)
+        else:
+            # Still queued, so the roundup gets another try next pass
+            print(f'Post failed: {e}')
+        return
+
+    state = 'posted'
+    post_time = datetime.now()
+    updates = []
+    for id in json_data['ids']:
+        latency = detect_to_post(queued_entries[id], post_time)
+        updates.append((queued_entries[id]['id'],
+                        {'state': state, 'post_timestamp': post_time.isoformat(),
+                         'post_latency': latency}))
+        print(f"  Remove {id}: {queued_entries[id]['id']} ({latency}s after fetch)")
+        state = 'dupe'
+    store.update_many(updates)
+    count('posts', kind='roundup' if len(json_data['ids']) > 1 else 'dequeued',
+          target=target.name)
+    gauge('detect_to_post_seconds', updates[0][1]['post_latency'], kind='queued',
+          target=target.name)
+
+def recent_posts(store, target):
+    """The target's last day of posts (and queued stories), with an index for dedup."""
+    posted_entries = []
+    time_threshold = datetime.now() - timedelta(hours=24)
+
+    # Fetch all previous posts
+    for entry in store.by_state('posted', 'queued', 'dupe', UNCONFIRMED, target=target.name):
+        if entry['state'] == 'posted' and datetime.fromisoformat(entry['post_timestamp']) < time_threshold:
+            break
+
+        posted_entries.append(entry)
+
+    posted_index = NearDupIndex()
+    for index, posted_entry in enumerate(posted_entries):
+        posted_index.add(index, posted_entry['title'])
+
+    return posted_entries, posted_index
+
+def post_story(store, client, poster, target):
+    for entry in store.by_state('post', order='timestamp', limit=1, target=target.name):
+        return post_entry(store, client, poster, entry, target)
+    return False
+
+def post_entry(store, client, poster, entry, target):
+    """Dedup-check one story and post it, queue it, or drop it.
+
+    Returns True if it was posted. Used for the story pick_story chose, and
+    straight from the rating stage for breaking stories.
+    """
+    posted_entries, posted_index = recent_posts(store, target)
+
+    # Exact and near-exact repeats don't need the model
+    dupe_of = posted_index.duplicate(entry['title'])
+    if dupe_of is not None:
+        print(f"Near-duplicate of: {posted_entries[dupe_of]['title']}")
+        print('Duplicate; skipping')
+        store.update(entry['id'], {'state': 'old'})
+        return False
+
+    # Only show the model the prior posts closest to this one
+    close_entries = [posted_entries[index]
+                     for score, index in posted_index.closest(entry['title'])]
+
+    current_query = dedup_prompt(entry['title'],
+                                 [close_entry['title'] for close_entry in close_entries])
+
+    try:
+        result_str = client.complete(current_query, 'dedup')
+    except LLMError as e:
+        print(f'Dedup check failed: {e}')
+        return False
+
+    log_query('dedup', current_query, result_str, [entry['id']])
+
+    print('--- Query')
+    print(current_query)
+    print()
+
+    print('--- Result')
+    print(result_str)
+
+    try:
+        dupe, idx, us_only = parse_dedup(result_str)
+    except ParseError as e:
+        print(f'Unpack problem... {e}')
+        # Left marked 'post' for another try, but not forever
+        failures = entry.get('dedup_failures', 0) + 1
+        if failures >= MAX_DEDUP_FAILURES:
+            print(f'Dedup check failed {failures} times; giving up')
+            store.update(entry['id'], {'state': 'old', 'dedup_failures': failures})
+        else:
+            store.update(entry['id'], {'dedup_failures': failures})
+        return False
+
+    if dupe > 0 and idx >= len(close_entries):
+        print(f'No story {idx} to be a duplicate of; treating as unique')
+        dupe = 0
+    us = ('usnews' if us_only else 'worldnews')
+
+    print(f'{dupe} {idx} {us}')
+
+    if dupe == 2:
+        print('Duplicate; skipping')
+        store.update(entry['id'], {'state': 'old'})
+        return False
+    elif dupe == 1:
+        print('Same topic; queueing')
+        if 'schedule_timestamp' in close_entries[idx]:
+            schedule_timestamp = close_entries[idx]['schedule_timestamp']
+        else:
+            schedule_timestamp = datetime.fromisoformat(close_entries[idx]['post_timestamp'])
+            schedule_timestamp += timedelta(hours=QUEUE_DELAY)
+            schedule_timestamp = schedule_timestamp.isoformat()
+
+        store.update(entry['id'],
+                     {'state': 'queued',
+                      'schedule_timestamp': schedule_timestamp,
+                      'category': us})
+            
+        return False
+    elif dupe == 0:
+        pass # Success! We should post.
+    else:
+        raise Exception("Can't happen! Dupe status is " + dupe)
+        
+    print(f'Posting to {target.name}!')
+    print(target.magazine_for(us))
+    print()
+
+    print(f"Feed: {entry['feed']}")
+    print(f"ID: {entry['id']}")
+    print(f"Title: {entry['title']}")
+    print(f"Link: {entry['link']}")
+    print(f"Published: {entry['published']}")
+    print(f"Fetched: {entry['timestamp']}\n")
+    print()
+
+    # Make the POST request
+    try:
+        submit_post(poster, target.user, target.magazine_for(us),
+                    entry['title'], url=entry['link'])
+    except PostError as e:
+        if e.maybe_posted:
+            hold_unconfirmed(store, [entry], target)
+        else:
+            # Left marked 'post', to try again next pass
+            print(f'Post failed: {e}')
+        return False
+
+    post_time = datetime.now()
+    latency = detect_to_post(entry, post_time)
+    print(f'Detect to post: {latency}s')
+    store.update(entry['id'],
+                 {'state': 'posted', 'post_timestamp': post_time.isoformat(),
+                  'post_latency': latency})
+    count('posts', kind='link', target=target.name)
+    gauge('detect_to_post_seconds', latency, kind='link', target=target.name)
+
+    return True
+
+def hold_unconfirmed(store, entries, target):
+    """Park the stories of a post that may or may not have gone out, so
+    nothing tries it again until someone's checked."""
+    print(f"Post may have gone through; held as {UNCONFIRMED}: "
+          f"{', '.join(entry['id'] for entry in entries)}")
+    attempt_time = datetime.now().isoformat()
+    store.update_many([(entry['id'], {'state': UNCONFIRMED,
+                                      'unconfirmed_from': entry['state'],
+                                      'post_timestamp': attempt_time})
+                       for entry in entries])
+    count('posts_unconfirmed', target=target.name)
+
+# Mbin stuff
+
+def submit_post(poster, user, magazine, title, url=None, body=None):
+    print('About to post')
+    response = poster.post(user, magazine, title, url=url, body=body)
+    print(f'Posted: {response.strip()}' if response and response.strip() else 'Posted')
+
+def run_posting(store, client, poster, targets=None):
+    """One dedup/post pass for each target: a due roundup, or else the picked story."""
+    if targets is None:
+        targets = load_targets()
+    for target in targets:
+        if not try_to_dequeue(store, client, poster, target):
+            post_story(store, client, poster, target)
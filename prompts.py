@@ -0,0 +1,164 @@
+from functools import lru_cache
+import json
+
+from metrics import timed
+
+"""
+Prompt Construction
+
+Builds the prompts for the three model call sites. The parts that never
+change (the instructions, and for rating the seed examples) are assembled
+once per process and always come first, so the provider's prompt caching can
+reuse them from one call to the next; only the stories for this call are
+appended after.
+
+Each builder returns the finished prompt string.
+"""
+
+# Path to the rating examples
+SEED_PATH = 'ratings-seed.json'
+
+@lru_cache(maxsize=None)
+def rating_seed():
+    """(seed headline lines, seed answer lines, number of seed stories)."""
+    with open(SEED_PATH) as infile:
+        seed_data = json.load(infile)
+    headlines = ''.join(json.dumps([index, entry[1]]) + "\n"
+                        for index, entry in enumerate(seed_data[0]))
+    answers = ''.join(json.dumps(entry) + "\n" for entry in seed_data[1])
+    return headlines, answers, len(seed_data[0])
+
+RATING_INSTRUCTIONS = (
+    "Okay! So our task is to rate the stories below, and classify them into 'us-only' (of interest\n"
+    "only within the US) or 'world' (of global interest, which may include US stories of\n"
+    "a sufficient level of importance.)\n"
+    "\n"
+    "We'll output a series of JSON-format lists, consisting of:\n"
+    "  1. The index number of each story we're referencing\n"
+    "  2. The star rating of the story:\n"
+    "     * = very uninteresting\n"
+    "    ** = meh story\n"
+    "   *** = interesting story\n"
+    "  **** = highly interesting story\n"
+    " ***** = fascinating, highly popular story\n"
+    "  3. A classification of the story; could be 'us-only' (primarily of interest\n"
+    "     only inside the US) or 'world' (of global interest, although world stories can\n"
+    "     also involve the US).\n"
+    "  4. A tag for the topic of the story; one or two words that encapsulate what the\n"
+    "     story is concerning, so that stories can be grouped and deduplicated.\n"
+    "We'll have to be careful to output *only*\n"
+    "the JSON lists, without discussion, since this output forms the input to a software system\n"
+    "which accepts only JSON data.\n"
+    "\n"
+    "The stories are:\n"
+)
+
+@lru_cache(maxsize=None)
+def rating_prefix():
+    return RATING_INSTRUCTIONS + rating_seed()[0]
+
+def seed_count():
+    return rating_seed()[2]
+
+@timed('prompt', site='rate')
+def rating_prompt(stories):
+    """Prompt to rate these stories; they're numbered after the seed stories."""
+    headlines, answers, count = rating_seed()
+    lines = [json.dumps([index + count, entry['title']]) + "\n"
+             for index, entry in enumerate(stories)]
+    return ''.join([rating_prefix(), *lines, "\nThe list is:\n", answers])
+
+DEDUP_INSTRUCTIONS = (
+    "Okay! So our task is, quite simply, to detect duplication among stories. We'll\n"
+    "be given a numbered list of recent stories, then a new story, and output one of the\n"
+    "following values:\n"
+    "  2: There's already a story in the list covering the exact same material; we don't\n"
+    "     need to publish both.\n"
+    "  1: Unique story, but on the same topic as another story in the list, so it can wait\n"
+    "     so as not to hammer the same topic.\n"
+    "  0: Unique story, no duplication (or breaking news we should publish now).\n"
+    "Then, in addition, we'll be outputting a 'us-only' flag on stories which are only\n"
+    "of interest within the US. A global story that *involves* the US shouldn't get the\n"
+    "'us-only' flag. But if it's *only* of interest to US people, it's 'us-only'.\n"
+    "We'll output that all within a tuple so we can indicate which story is duplicated. So\n"
+    "the possibilities are things like: (0, None, None), or (1, n, 'us-only'), or\n"
+    "(1, n, None), or (2, n, 'us-only'), where n is\n"
+    "one of the indices in the list.\n"
+    "We'll have to be careful to output *only*\n"
+    "the tuple, without discussion, since this output forms the input to a software system\n"
+    "which accepts strict input.\n"
+    "\n"
+    "The recent stories are:\n"
+)
+
+FLAG_INSTRUCTIONS = (
+    "Okay! So our task is, quite simply, to output a 'us-only' flag on stories which are only\n"
+    "of interest within the US. A global story that *involves* the US shouldn't get the\n"
+    "'us-only' flag. But if it's *only* of interest to US people, it's 'us-only'.\n"
+    "We'll output that within a tuple -- the possibilities are\n"
+    "(0, None, 'us-only') for mainly-US stories, or (0, None, None) for stories of global interest (which may still involve the US).\n"
+    "We'll have to be careful to output *only*\n"
+    "the tuple, without discussion, since this output forms the input to a software system\n"
+    "which accepts strict input.\n"
+)
+
+@timed('prompt', site='dedup')
+def dedup_prompt(title, prior_titles):
+    """Prompt to check a story against recent posts (or just flag it, if none)."""
+    if not prior_titles:
+        return ''.join([FLAG_INSTRUCTIONS,
+                        "\nThe story we're classifying is:\n",
+                        f"{title}\n",
+                        "\nThe result is: ("])
+
+    lines = [f"{index}: {prior}\n" for index, prior in enumerate(prior_titles)]
+    return ''.join([DEDUP_INSTRUCTIONS, *lines,
+                    "\nThe story we're classifying is:\n",
+                    f"{title}\n",
+                    "\nThe result is: ("])
+
+ROUNDUP_INSTRUCTIONS = (
+    "Okay! So our task is, quite simply, to collate a group of similar stories\n"
+    "into a single round-up post that summarizes everything that's happened\n"
+    "recently, in summary that's easier to read than repeated duplicate posts.\n"
+    "\n"
+    "To that end, we're going to want to output a mapping of the following fields\n"
+    "in a little JSON-encoded hash. Bear in mind that this output will be read by\n"
+    "an automated system, so we must be *strict* in outputting only the JSON, and\n"
+    "no commentary or anything else.\n"
+    "\n"
+    "The values we need to be defining in the map are:\n"
+    "  * 'ids': A list of IDS of stories similar to story #0 (including story #0\n"
+    "           itself). This should be a list of integers in the JSON.\n"
+    "  * 'title': A summary title, i.e. a consolidated headline.\n"
+    "             The consolidated headline should be the headline you would give\n"
+    "             to a single article that summarized everything in the combined stories.\n"
+    "             Make sure to use active voice for the headline, and use a fairly similar style as the list of headlines below.\n"
+    "             It should be a *string* in the JSON.\n"
+    "  * 'body': A markdown-formatted list of the matching news stories that we're\n"
+    "            consolidating. This can be a bulleted list, of the format:\n"
+    "            '* New York Times - [Title of NYT Article](https://link/to/article)'\n"
+    "            ... obviously with substitutions to the actual values. Where a story\n"
+    "            lists other outlets that also carried it, credit them on the same line,\n"
+    "            like: ' (also [BBC](https://link/to/bbc/article))'. This should be\n"
+    "            a string in the JSON.\n"
+    "\n"
+    "(The summary under 'title', if one is needed, should be a few words about\n"
+    "what's going on or what's changed, based on the headlines of the stories in the roundup.)\n"
+    "\n"
+    "We're trying to consolidate all the stories that share the same topic (the same war\n"
+    "or world event, or the same person, etc) with story #0, including story #0 itself.\n"
+    "And again, the output will be read by a software system, so it needs to be strict\n"
+    "JSON with nothing additional.\n"
+    "\n"
+    "The stories are:\n"
+)
+
+@timed('prompt', site='roundup')
+def roundup_prompt(entries):
+    """Prompt to round up stories similar to entries[0]."""
+    lines = [f"{index}: {entry['title']}\n    {entry.get('channel', 'Link')}: {entry['link']}\n"
+             + ''.join(f"    also {source.get('channel') or 'Link'}: {source['link']}\n"
+                       for source in entry.get('sources', ()))
+             for index, entry in enumerate(entries)]
+    return ''.join([ROUNDUP_INSTRUCTIONS, *lines, "\nThe output JSON is:\n"])
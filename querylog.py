@@ -0,0 +1,179 @@
+from datetime import datetime
+import glob
+import gzip
+import json
+import os
+import re
+import shutil
+import threading
+
+from locks import QUERY_LOG_LOCK, file_lock
+
+"""
+Query Log
+
+Append-only log of every model call, for debugging: one JSON object per line
+in all-queries.jsonl, with the time, the call site, the story ids involved,
+the prompt, the reply and the tokens it used (records from before usage
+was logged don't have them). Logging a call is a single append, however long
+the history gets.
+
+Once the live file passes MAX_LOG_BYTES, or the day changes, it's rotated to
+all-queries-<timestamp>.jsonl.gz. read_queries streams back across the
+rotated segments and the live file, oldest first, one record at a time.
+
+Several processes can log at once: appends and rotation happen under a file
+lock. A writer killed mid-append leaves a torn last line; the next append
+starts on a fresh line, and readers skip the torn one.
+"""
+
+# Path to the live log
+QUERY_LOG_PATH = 'all-queries.jsonl'
+
+# The old whole-file JSON log, for migration
+LEGACY_LOG_PATH = 'all-queries.json'
+
+# Tuning parameters
+MAX_LOG_BYTES = 20 * 1024 * 1024
+COMPRESS_ROTATED = True
+
+# The rotation time in a segment's name
+SEGMENT_STAMP = re.compile(r'-(\d{4})(\d{2})(\d{2})-(\d{2})(\d{2})(\d{2})')
+
+lock = threading.Lock()
+
+def segment_paths(path=QUERY_LOG_PATH):
+    """Rotated segments, oldest first, then the live file."""
+    base, ext = os.path.splitext(path)
+    compressed = glob.glob(f'{base}-*{ext}.gz')
+    # A rotation that died before removing the uncompressed copy leaves both
+    segments = sorted([segment for segment in glob.glob(f'{base}-*{ext}')
+                       if segment + '.gz' not in compressed] + compressed)
+    if os.path.exists(path):
+        segments.append(path)
+    return segments
+
+def rotated_at(segment):
+    """When a segment was rotated, to the second, as an ISO timestamp; None
+    for the live file."""
+    match = SEGMENT_STAMP.search(os.path.basename(segment))
+    if match is None:
+        return None
+    year, month, day, hour, minute, second = match.groups()
+    return f'{year}-{month}-{day}T{hour}:{minute}:{second}'
+
+def rotate(path=QUERY_LOG_PATH, compress=COMPRESS_ROTATED):
+    base, ext = os.path.splitext(path)
+    rotated = f"{base}-{datetime.now().strftime('%Y%m%d-%H%M%S')}{ext}"
+    os.replace(path, rotated)
+    if compress:
+        with open(rotated, 'rb') as infile, gzip.open(rotated + '.gz.tmp', 'wb') as outfile:
+            shutil.copyfileobj(infile, outfile)
+        os.replace(rotated + '.gz.tmp', rotated + '.gz')
+        os.remove(rotated)
+
+def needs_rotation(path, now):
+    if not os.path.exists(path):
+        return False
+    stat = os.stat(path)
+    if stat.st_size >= MAX_LOG_BYTES:
+        return True
+    return stat.st_size > 0 and datetime.fromtimestamp(stat.st_mtime).date() != now.date()
+
+def log_query(site, query, completion, story_ids=(), path=QUERY_LOG_PATH):
+    """Append one model call to the log. If the completion came from
+    LLMClient (an llm.Completion), the tokens it used are logged as well."""
+    now = datetime.now()
+    record = {'timestamp': now.isoformat(),
+              'site': site,
+              'story_ids': list(story_ids),
+              'query': query,
+              'completion': completion}
+    usage = getattr(completion, 'usage', None)
+    if usage is not None:
+        record['usage'] = usage
+
+    with lock, file_lock(QUERY_LOG_LOCK):
+        if needs_rotation(path, now):
+            rotate(path)
+        with open(path, 'a+b') as outfile:
+            line = json.dumps(record) + '\n'
+            # Start afresh after a line torn by a writer that was killed
+            if outfile.tell() > 0:
+                outfile.seek(-1, os.SEEK_END)
+                if outfile.read(1) != b'\n':
+                    line = '\n' + line
+            outfile.write(line.encode())
+
+def read_queries(path=QUERY_LOG_PATH, site=None, since=None, until=None, story_id=None):
+    """Yield logged records, oldest first, filtered as they're read.
+
+    since / until are ISO timestamps (or dates); story_id matches any record
+    that involved that story. Segments rotated before `since`, or after
+    `until` had passed, are skipped without being opened.
+    """
+    previous = None
+    for segment in segment_paths(path):
+        closed = rotated_at(segment)
+        # Everything in a segment was logged before it was rotated, and
+        # after the segment before it was
+        if since is not None and closed is not None and closed < since[:19]:
+            previous = closed
+            continue
+        if until is not None and previous is not None and previous >= until:
+            return
+        previous = closed
+
+        opener = gzip.open if segment.endswith('.gz') else open
+        with opener(segment, 'rt') as infile:
+            for line in infile:
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn by a writer that was killed mid-append
+                    continue
+                if site is not None and record.get('site') != site:
+                    continue
+                if since is not None and record['timestamp'] < since:
+                    continue
+                if until is not None and record['timestamp'] >= until:
+                    continue
+                if story_id is not None and story_id not in record.get('story_ids', ()):
+                    continue
+                yield record
+
+def guess_site(query):
+    """Which call site a legacy record came from, going by the prompt."""
+    if 'to detect duplication among stories' in query or "output a 'us-only' flag" in query:
+        return 'dedup'
+    if 'to collate a group of similar stories' in query:
+        return 'roundup'
+    return 'rate'
+
+def migrate_legacy_log(legacy_path=LEGACY_LOG_PATH, path=QUERY_LOG_PATH):
+    """One-shot conversion of the old all-queries.json into a rotated segment.
+
+    Returns how many records were converted. The old file is renamed with
+    a .migrated suffix so this doesn't happen twice.
+    """
+    if not os.path.exists(legacy_path):
+        return 0
+
+    with open(legacy_path) as infile:
+        records = json.load(infile)
+
+    stamp = datetime.fromtimestamp(os.stat(legacy_path).st_mtime)
+    base, ext = os.path.splitext(path)
+    segment = f"{base}-{stamp.strftime('%Y%m%d-%H%M%S')}-legacy{ext}.gz"
+    with gzip.open(segment, 'wt') as outfile:
+        for record in records:
+            outfile.write(json.dumps({'timestamp': stamp.isoformat(),
+                                      'site': guess_site(record['query']),
+                                      'story_ids': [],
+                                      'query': record['query'],
+                                      'completion': record['completion']}) + '\n')
+
+    os.replace(legacy_path, legacy_path + '.migrated')
+    return len(records)
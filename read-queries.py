@@ -0,0 +1,37 @@
+import argparse
+import json
+import sys
+
+from querylog import QUERY_LOG_PATH, read_queries
+
+"""
+Query Log Reader
+
+Streams records out of the query log (the live file and any rotated, gzipped
+segments), filtered by call site, time range or story id, without loading the
+whole history.
+
+Usage: read-queries.py [--site rate|dedup|roundup] [--since DATE] [--until DATE]
+                       [--story ID] [--json]
+"""
+
+parser = argparse.ArgumentParser(description='Stream-filter the model query log.')
+parser.add_argument('--log', default=QUERY_LOG_PATH)
+parser.add_argument('--site', help='call site: rate, dedup or roundup')
+parser.add_argument('--since', help='ISO date or timestamp, inclusive')
+parser.add_argument('--until', help='ISO date or timestamp, exclusive')
+parser.add_argument('--story', help='only calls involving this story id')
+parser.add_argument('--json', action='store_true', help='print raw JSON lines')
+args = parser.parse_args()
+
+for record in read_queries(args.log, site=args.site, since=args.since,
+                           until=args.until, story_id=args.story):
+    if args.json:
+        sys.stdout.write(json.dumps(record) + '\n')
+        continue
+
+    print(f"=== {record['timestamp']} {record['site']} ({len(record['story_ids'])} stories)")
+    print(record['query'])
+    print('--- Completion')
+    print(record['completion'])
+    print()
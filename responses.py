@@ -0,0 +1,155 @@
+import json
+import logging
+import re
+
+from metrics import count, timed
+
+"""
+Model Response Parsing
+
+One place that turns the model's replies into data, for all three call
+sites. Each parser takes whatever it can get: JSON values are pulled out of
+the reply wherever they appear (inside code fences, one per line, or all in
+one array), and a piece that doesn't parse only costs that piece. A batch
+of 25 ratings with one bad line still gives back the other 24; nothing is
+sent back to the model to try again.
+"""
+
+logger = logging.getLogger(__name__)
+
+class ParseError(Exception):
+    pass
+
+def json_values(text):
+    """Yield every top-level JSON array or object found in the text."""
+    if not text:
+        return
+    decoder = json.JSONDecoder()
+    position = 0
+    while True:
+        starts = [found for found in (text.find('[', position), text.find('{', position))
+                  if found != -1]
+        if not starts:
+            return
+        start = min(starts)
+        try:
+            value, end = decoder.raw_decode(text, start)
+        except json.JSONDecodeError:
+            # Not valid from here; maybe from the next bracket in
+            position = start + 1
+            continue
+        yield value
+        position = end
+
+def rating_rows(value):
+    """Flatten a decoded value into candidate [index, stars, category, topic] rows."""
+    if isinstance(value, dict):
+        for key in ('ratings', 'stories', 'results'):
+            if key in value:
+                yield from rating_rows(value[key])
+                return
+        if 'index' in value:
+            yield [value.get('index'), value.get('stars', value.get('rating')),
+                   value.get('category'), value.get('topic')]
+        return
+    if isinstance(value, list):
+        if value and all(isinstance(item, (list, dict)) for item in value):
+            for item in value:
+                yield from rating_rows(item)
+        else:
+            yield value
+
+def stars_to_rating(stars):
+    if isinstance(stars, int):
+        rating = stars
+    elif isinstance(stars, str) and stars.strip('* ') == '':
+        rating = stars.count('*')
+    elif isinstance(stars, str) and stars.strip().isdigit():
+        rating = int(stars.strip())
+    else:
+        return None
+    return max(1, min(5, rating))
+
+@timed('parse', site='rate')
+def parse_ratings(text):
+    """Pull every usable rating out of a rating reply.
+
+    Returns a list of (index, rating, category, topic); rows that don't make
+    sense are logged and skipped.
+    """
+    if not text or not text.strip():
+        logger.info('Empty rating reply')
+        count('parse_empty', site='rate')
+        return []
+    ratings = []
+    for value in json_values(text):
+        for row in rating_rows(value):
+            if not isinstance(row, list) or len(row) < 4:
+                logger.info(f"Skipping rating row: {row!r}")
+                count('parse_rows_skipped', site='rate')
+                continue
+            index, stars, category, topic = row[:4]
+            rating = stars_to_rating(stars)
+            if not isinstance(index, int) or rating is None:
+                logger.info(f"Skipping rating row: {row!r}")
+                count('parse_rows_skipped', site='rate')
+                continue
+            ratings.append((index, rating, str(category), str(topic)))
+    count('parse_rows', len(ratings), site='rate')
+    return ratings
+
+@timed('parse', site='dedup')
+def parse_dedup(text):
+    """Parse a duplicate-check reply like "1, 3, 'us-only')".
+
+    Returns (dupe, idx, us_only); idx is None when dupe is 0.
+    """
+    if not text or not text.strip():
+        raise ParseError('Empty duplicate-check reply')
+    match = re.search(r'\b([0-2])\b', text)
+    if match is None:
+        raise ParseError(f"No duplicate status in {text!r}")
+    dupe = int(match.group(1))
+
+    rest = text[match.end():]
+    idx = None
+    if dupe > 0:
+        found = re.search(r'\d+', rest)
+        if found is None:
+            raise ParseError(f"No story index in {text!r}")
+        idx = int(found.group())
+
+    return dupe, idx, 'us-only' in rest
+
+@timed('parse', site='roundup')
+def parse_roundup(text, count):
+    """Parse a roundup reply into {'ids', 'title', 'body'}.
+
+    ids are limited to 0..count-1 with story 0 always included; title and
+    body are None if the reply didn't have usable ones, for the caller to
+    fill in.
+    """
+    if not text or not text.strip():
+        raise ParseError('Empty roundup reply')
+    for value in json_values(text):
+        if isinstance(value, dict) and 'ids' in value:
+            break
+    else:
+        raise ParseError(f"No roundup object in {text!r}")
+
+    ids = [0]
+    for id in value.get('ids') or []:
+        try:
+            id = int(id)
+        except (TypeError, ValueError):
+            continue
+        if 0 <= id < count and id not in ids:
+            ids.append(id)
+
+    title = value.get('title')
+    body = value.get('body')
+    if isinstance(body, list):
+        body = '\n'.join(str(line) for line in body)
+    return {'ids': ids,
+            'title': title.strip() if isinstance(title, str) and title.strip() else None,
+            'body': body.strip() if isinstance(body, str) and body.strip() else None}
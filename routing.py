@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+
+from clusters import topic_key
+from metrics import count
+
+"""
+Story Routing
+
+Decides which community each rated story is posted to, so one fetch and
+one rating pass (one store, one rating cache) can feed several of them. A
+target is a user and magazine(s) to post as and to, the rules for which
+stories it takes, and its own posting window: no more than max_stories
+posts per story_window minutes, and stories rated below *** only while
+it's had fewer than min_stories. Each target picks, queues, dedups and
+posts its own stories.
+
+Targets come from targets.json, if it exists, in order; a story goes to the
+first target whose rules it matches:
+
+  [{"name": "tech", "user": "news", "magazine": "technology",
+    "feeds": ["https://www.wired.com/feed/rss", "https://www.techdirt.com/feed/"],
+    "max_stories": 4, "min_stories": 2},
+   {"name": "news", "user": "news",
+    "magazines": {"usnews": "usnews", "worldnews": "worldnews"}}]
+
+A rule is a list of feed URLs, rating categories ('us-only', 'world') or
+topic tags; a story must match every rule a target has, and a target with
+no rules takes anything. A story no target takes is retired. Without
+targets.json there's the one DEFAULT_TARGET, which posts everything to
+usnews or worldnews, as before.
+
+magazines maps the dedup check's verdict ('usnews' for a US-only story,
+'worldnews' otherwise) to a magazine; magazine is used for anything not
+in it.
+"""
+
+logger = logging.getLogger(__name__)
+
+# Path to the target configuration
+TARGETS_CONFIG_PATH = 'targets.json'
+
+# Stories from before routing existed all belong to this one
+DEFAULT_TARGET = 'news'
+
+# Default posting window for a target
+STORY_WINDOW = 120 # in minutes
+MAX_STORIES_PER_WINDOW = 10
+MIN_STORIES_PER_WINDOW = 8
+
+class Target:
+    def __init__(self, name, user='news', magazine=None, magazines=None,
+                 feeds=(), categories=(), topics=(), story_window=STORY_WINDOW,
+                 max_stories=MAX_STORIES_PER_WINDOW, min_stories=MIN_STORIES_PER_WINDOW):
+        self.name = name
+        self.user = user
+        self.magazine = magazine
+        self.magazines = magazines or {}
+        self.feeds = set(feeds)
+        self.categories = set(categories)
+        self.topics = {topic_key(topic) for topic in topics}
+        self.story_window = story_window
+        self.max_stories = max_stories
+        self.min_stories = min_stories
+
+    def __repr__(self):
+        return f'Target({self.name!r})'
+
+    def matches(self, entry):
+        if self.feeds and entry.get('feed') not in self.feeds:
+            return False
+        if self.categories and entry.get('category') not in self.categories:
+            return False
+        if self.topics and topic_key(entry.get('topic')) not in self.topics:
+            return False
+        return True
+
+    def magazine_for(self, kind):
+        """The magazine to post to, given the dedup check's 'usnews' / 'worldnews'."""
+        return self.magazines.get(kind, self.magazine or kind)
+
+def default_targets():
+    return [Target(DEFAULT_TARGET, magazines={'usnews': 'usnews', 'worldnews': 'worldnews'})]
+
+def load_targets(config_path=TARGETS_CONFIG_PATH):
+    if not os.path.exists(config_path):
+        return default_targets()
+
+    with open(config_path) as infile:
+        config = json.load(infile)
+
+    targets = [Target(**fields) for fields in config]
+    names = [target.name for target in targets]
+    if not targets or len(set(names)) != len(names):
+        raise Exception(f'{config_path} needs at least one target, each with its own name')
+    return targets
+
+def route_stories(store, targets):
+    """Give each rated, unrouted candidate a target; retire the ones no target takes.
+
+    Returns how many stories were routed.
+    """
+    updates = []
+    routed = 0
+    for entry in store.unrouted():
+        target = next((target for target in targets if target.matches(entry)), None)
+        if target is None:
+            updates.append((entry['id'], {'state': 'old'}))
+            continue
+        updates.append((entry['id'], {'target': target.name}))
+        count('stories_routed', target=target.name)
+        routed += 1
+    store.update_many(updates)
+
+    if updates:
+        logger.info(f'Routed {routed} stories; {len(updates) - routed} matched no target')
+    return routed
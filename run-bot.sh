@@ -1,7 +1,8 @@
 #!/bin/bash
 
+# The daemon keeps everything loaded between cycles and schedules each feed
+# itself; this just restarts it if it dies.
 while true; do
-    pyenv/bin/python rss-fetch.py || break
-    pyenv/bin/python dedup-and-post.py || break
-    sleep 600 # 10 minutes
+    pyenv/bin/python bot-daemon.py && break
+    sleep 60
 done
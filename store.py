@@ -0,0 +1,513 @@
+from collections import defaultdict
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+import sys
+import time
+
+from history import COLUMNS, TIMES, StoryHistory
+from metrics import count, observe, timed
+from routing import DEFAULT_TARGET
+from urls import canonical_url
+
+"""
+Story Store
+
+SQLite-backed storage for the stories, shared by rss-fetch.py, dedup-and-post.py
+and bot-report.py. Replaces the TinyDB JSON file, which had to be rewritten
+in full on every update and scanned in full on every search.
+
+There's also a small rating cache, so the same headline showing up in
+several feeds only gets rated once.
+
+Stories go in and come out as plain dicts, same as they did with TinyDB; keys
+that aren't set are left out of the dict entirely, so `'rating' in entry`
+still works. Anything that doesn't have its own column rides along in `extra`.
+Reading days of history at once, history() gives a compact columnar
+StoryHistory (history.py) instead.
+
+Each story also has a canonical key for its link (urls.py), indexed, so the
+same article from another feed or under a tracking URL can be found at
+insert time, and a topic cluster (clusters.py), so a roundup can find its
+stories without a scan. Once rated, a story also has the target community
+it's routed to (routing.py), and the per-cycle questions take a target.
+"""
+
+# Path to the database file
+STORE_PATH = 'rss-feed-data.db'
+
+# The old TinyDB file, for migration
+TINYDB_PATH = 'rss-feed-data.json'
+
+# How long to wait on another process's write before giving up
+BUSY_TIMEOUT = 30 # in seconds
+
+# Fields with few distinct values, shared between the dicts that hold them
+INTERNED = {'feed', 'channel', 'state', 'category', 'topic', 'target'}
+
+# Stories from before routing that belong to the default target: those rated
+# (or still to be rated) and those in these states
+ROUTED_STATES = ('post', 'posted', 'dupe', 'queued')
+
+# The rating backlog. Queries for it use this exact condition, so SQLite can
+# use the partial index on it.
+UNRATED = "state IN ('new', 'avail', 'highlight') AND rating IS NULL"
+
+FIELDS = ('feed', 'title', 'link', 'published', 'timestamp', 'state',
+          'channel', 'rating', 'category', 'topic', 'post_timestamp',
+          'schedule_timestamp', 'canonical', 'cluster', 'target')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS stories (
+    id TEXT PRIMARY KEY,
+    feed TEXT,
+    title TEXT,
+    link TEXT,
+    published TEXT,
+    timestamp TEXT,
+    state TEXT,
+    channel TEXT,
+    rating INTEGER,
+    category TEXT,
+    topic TEXT,
+    post_timestamp TEXT,
+    schedule_timestamp TEXT,
+    canonical TEXT,
+    cluster TEXT,
+    target TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS stories_timestamp ON stories (timestamp);
+CREATE INDEX IF NOT EXISTS stories_post_timestamp ON stories (post_timestamp);
+
+-- SQLite keeps these up to date on every insert and state change, so the
+-- per-cycle questions (posts in the window, newest candidates, best-rated
+-- candidate) are answered with an index seek rather than a scan and sort.
+DROP INDEX IF EXISTS stories_state;
+CREATE INDEX IF NOT EXISTS stories_state_timestamp ON stories (state, timestamp);
+CREATE INDEX IF NOT EXISTS stories_state_post_timestamp ON stories (state, post_timestamp);
+CREATE INDEX IF NOT EXISTS stories_state_rating ON stories (state, rating, timestamp);
+
+CREATE TABLE IF NOT EXISTS rating_cache (
+    key TEXT PRIMARY KEY,
+    rating INTEGER,
+    category TEXT,
+    topic TEXT,
+    created TEXT
+);
+CREATE INDEX IF NOT EXISTS rating_cache_created ON rating_cache (created);
+"""
+
+class Store:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        with timed('db_open'):
+            self.conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, isolation_level=None)
+            self.conn.row_factory = sqlite3.Row
+            # Readers and the writer don't block each other, and a crash
+            # mid-write leaves the last committed state
+            self.conn.execute('PRAGMA journal_mode = WAL')
+            self.conn.execute('PRAGMA synchronous = NORMAL')
+            self.depth = 0
+            with self.transaction():
+                # Not executescript, which would commit the transaction first
+                for statement in SCHEMA.split(';'):
+                    self.conn.execute(statement)
+                self.upgrade()
+
+    def upgrade(self):
+        """Bring a store made by an older version up to the current schema.
+
+        Runs inside the opening transaction, so two processes opening an old
+        store at once don't both try it.
+        """
+        columns = {row['name'] for row in self.conn.execute('PRAGMA table_info(stories)')}
+        if 'canonical' not in columns:
+            self.conn.execute('ALTER TABLE stories ADD COLUMN canonical TEXT')
+            self.conn.executemany(
+                'UPDATE stories SET canonical = ? WHERE id = ?',
+                [(canonical_url(row['link']), row['id'])
+                 for row in self.conn.execute('SELECT id, link FROM stories')])
+        if 'cluster' not in columns:
+            self.conn.execute('ALTER TABLE stories ADD COLUMN cluster TEXT')
+        if 'target' not in columns:
+            self.conn.execute('ALTER TABLE stories ADD COLUMN target TEXT')
+            marks = ','.join('?' * len(ROUTED_STATES))
+            self.conn.execute(f'UPDATE stories SET target = ? WHERE rating IS NOT NULL '
+                              f'OR state IN ({marks})', (DEFAULT_TARGET, *ROUTED_STATES))
+        self.conn.execute('CREATE INDEX IF NOT EXISTS stories_canonical '
+                          'ON stories (canonical)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS stories_cluster '
+                          'ON stories (cluster, timestamp)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS stories_state_target_post_timestamp '
+                          'ON stories (state, target, post_timestamp)')
+        # A target's best candidate, and the unrated backlog, newest first
+        self.conn.execute('CREATE INDEX IF NOT EXISTS stories_state_target_rating '
+                          'ON stories (state, target, rating, timestamp)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS stories_unrated ON stories (timestamp) '
+                          f"WHERE {UNRATED}")
+
+    def close(self):
+        # Keeps the planner's statistics fresh enough to pick the right index
+        self.conn.execute('PRAGMA optimize')
+        self.conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """Group writes so they're committed together, in one write.
+
+        Nests; only the outermost transaction commits.
+        """
+        if self.depth == 0:
+            start = time.perf_counter()
+            self.conn.execute('BEGIN IMMEDIATE')
+        self.depth += 1
+        try:
+            yield self
+        except BaseException:
+            self.depth -= 1
+            if self.depth == 0:
+                self.conn.execute('ROLLBACK')
+            raise
+        self.depth -= 1
+        if self.depth == 0:
+            self.conn.execute('COMMIT')
+            observe('db_write', time.perf_counter() - start)
+
+    # Reading
+
+    def _query(self, where='', params=(), order='timestamp DESC', limit=None):
+        sql = 'SELECT * FROM stories'
+        if where:
+            sql += ' WHERE ' + where
+        if order:
+            sql += ' ORDER BY ' + order
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        with timed('db_read'):
+            entries = [row_to_entry(row) for row in self.conn.execute(sql, params)]
+        count('db_rows_read', len(entries))
+        return entries
+
+    def get(self, id):
+        rows = self._query('id = ?', (id,), order=None)
+        return rows[0] if rows else None
+
+    def known_ids(self, ids):
+        """Which of these ids are already stored."""
+        ids = list(ids)
+        known = set()
+        # Stay under SQLite's bound-parameter limit
+        with timed('db_read'):
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start+500]
+                marks = ','.join('?' * len(chunk))
+                for row in self.conn.execute(
+                        f'SELECT id FROM stories WHERE id IN ({marks})', chunk):
+                    known.add(row[0])
+        return known
+
+    def by_canonical(self, keys):
+        """The stored story for each of these canonical keys, if there is one."""
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start+500]
+            marks = ','.join('?' * len(chunk))
+            # Newest first, so the oldest copy, which the others merge into, wins
+            for entry in self._query(f"canonical IN ({marks}) AND state != 'merged'",
+                                     chunk, order='timestamp DESC'):
+                found[entry['canonical']] = entry
+        return found
+
+    def all(self):
+        return self._query()
+
+    def history(self, since=None):
+        """Stories fetched after `since` (or all of them), oldest first, as a
+        compact StoryHistory rather than dicts."""
+        columns = ', '.join(f"CAST(strftime('%s', {name}, 'utc') AS INTEGER)"
+                            if name in TIMES else name for name in COLUMNS)
+        sql = f'SELECT {columns} FROM stories'
+        params = ()
+        if since is not None:
+            sql += ' WHERE timestamp > ?'
+            params = (since,)
+        sql += ' ORDER BY timestamp'
+
+        table = StoryHistory()
+        cursor = self.conn.cursor()
+        cursor.row_factory = None
+        with timed('db_read'):
+            for row in cursor.execute(sql, params):
+                table.append(*row)
+        count('db_rows_read', len(table))
+        return table
+
+    def by_state(self, *states, order='timestamp DESC', limit=None, target=None):
+        marks = ','.join('?' * len(states))
+        where, params = for_target(f'state IN ({marks})', states, target)
+        return self._query(where, params, order=order, limit=limit)
+
+    def older_than(self, timestamp, limit):
+        """The oldest stories fetched before this timestamp, up to limit."""
+        return self._query('timestamp < ?', (timestamp,), order='timestamp', limit=limit)
+
+    def since(self, timestamp):
+        return self._query('timestamp > ?', (timestamp,), order='timestamp')
+
+    def queued_before(self, timestamp, limit=None, target=None):
+        where, params = for_target("state = 'queued' AND timestamp < ?", (timestamp,), target)
+        return self._query(where, params, order='timestamp', limit=limit)
+
+    def queued_with_schedule(self, schedule_timestamp, target=None):
+        where, params = for_target("state = 'queued' AND "
+                                   "(timestamp = ? OR schedule_timestamp = ?)",
+                                   (schedule_timestamp, schedule_timestamp), target)
+        return self._query(where, params, order='timestamp')
+
+    def rated_since(self, timestamp):
+        """Rated stories fetched after this timestamp, oldest first, leaving out merged copies."""
+        return self._query("rating IS NOT NULL AND state != 'merged' AND timestamp > ?",
+                           (timestamp,), order='timestamp')
+
+    def cluster_sizes(self, since):
+        """{cluster: story count} for stories fetched after `since`."""
+        return dict(self.conn.execute(
+            "SELECT cluster, COUNT(*) FROM stories "
+            "WHERE cluster IS NOT NULL AND timestamp > ? GROUP BY cluster",
+            (since,)).fetchall())
+
+    def in_clusters(self, clusters, states, since):
+        """Stories in these states and topic clusters, fetched after `since`."""
+        clusters = list(clusters)
+        cluster_marks = ','.join('?' * len(clusters))
+        state_marks = ','.join('?' * len(states))
+        return self._query(f'cluster IN ({cluster_marks}) AND state IN ({state_marks}) '
+                           f'AND timestamp > ?', (*clusters, *states, since))
+
+    def posted_since(self, post_timestamp):
+        return self._query("state = 'posted' AND post_timestamp > ?",
+                           (post_timestamp,), order='post_timestamp DESC')
+
+    def unrated(self, limit=None):
+        """Candidates still waiting for a rating, newest first."""
+        return self._query(UNRATED, order='timestamp DESC', limit=limit)
+
+    def unrouted(self):
+        """Rated candidates that haven't been given a target yet."""
+        return self._query("state IN ('new', 'avail', 'highlight') "
+                           "AND rating IS NOT NULL AND target IS NULL", order='timestamp')
+
+    def best_rated(self, *states, target=None):
+        """The highest-rated story in these states; newest first on a tie."""
+        marks = ','.join('?' * len(states))
+        where, params = for_target(f'state IN ({marks}) AND rating IS NOT NULL',
+                                   states, target)
+        rows = self._query(where, params, order='rating DESC, timestamp DESC', limit=1)
+        return rows[0] if rows else None
+
+    def count_posted_since(self, post_timestamp, target=None):
+        # Posts that may have gone through count against the window too
+        where, params = for_target("state IN ('posted', 'unconfirmed') AND post_timestamp > ?",
+                                   (post_timestamp,), target)
+        return self.conn.execute(f'SELECT COUNT(*) FROM stories WHERE {where}',
+                                 params).fetchone()[0]
+
+    def page_by(self, state, column, since=None, until=None, target=None, page_size=500):
+        """Stories in one state with `column` ('timestamp' or 'post_timestamp')
+        in [since, until), newest first.
+
+        Read a page at a time, each page picking up where the last left off
+        on the (state, column) index, so it's as quick at the end of months
+        of history as at the start, and nothing is held but the current page.
+        """
+        if column not in ('timestamp', 'post_timestamp'):
+            raise ValueError(f'Not a timestamp column: {column}')
+        where, params = for_target(f'state = ? AND {column} IS NOT NULL', (state,), target)
+        if since is not None:
+            where += f' AND {column} >= ?'
+            params += (since,)
+        last = (until, None) if until is not None else None
+        while True:
+            if last is None:
+                page = self._query(where, params, order=f'{column} DESC, id DESC',
+                                   limit=page_size)
+            elif last[1] is None:
+                page = self._query(f'{where} AND {column} < ?', params + (last[0],),
+                                   order=f'{column} DESC, id DESC', limit=page_size)
+            else:
+                page = self._query(f'{where} AND ({column}, id) < (?, ?)', params + last,
+                                   order=f'{column} DESC, id DESC', limit=page_size)
+            yield from page
+            if len(page) < page_size:
+                return
+            last = (page[-1][column], page[-1]['id'])
+
+    def state_counts(self):
+        """{(state, target, rated): story count} over the whole store."""
+        return {(state, target, bool(rated)): total
+                for state, target, rated, total in self.conn.execute(
+                    'SELECT state, target, rating IS NOT NULL, COUNT(*) FROM stories '
+                    'GROUP BY state, target, rating IS NOT NULL')}
+
+    def count_by_feed(self, since):
+        """How many stories each feed has turned up since a timestamp."""
+        return dict(self.conn.execute(
+            "SELECT feed, COUNT(*) FROM stories WHERE timestamp > ? GROUP BY feed",
+            (since,)).fetchall())
+
+    def cached_ratings(self, keys, since):
+        """Rating cache entries for these keys, created after `since`.
+
+        Returns a dict of key -> {'rating', 'category', 'topic'}.
+        """
+        keys = list(keys)
+        found = {}
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start+500]
+            marks = ','.join('?' * len(chunk))
+            for row in self.conn.execute(
+                    f'SELECT * FROM rating_cache WHERE key IN ({marks}) AND created > ?',
+                    chunk + [since]):
+                found[row['key']] = {'rating': row['rating'],
+                                     'category': row['category'],
+                                     'topic': row['topic']}
+        return found
+
+    # Writing
+
+    def insert(self, entry):
+        self.insert_many([entry])
+
+    def insert_many(self, entries):
+        columns = ('id',) + FIELDS + ('extra',)
+        sql = (f'INSERT OR IGNORE INTO stories ({",".join(columns)}) '
+               f'VALUES ({",".join("?" * len(columns))})')
+        rows = [entry_to_row(entry) for entry in entries]
+        with self.transaction():
+            self.conn.executemany(sql, rows)
+        count('db_rows_written', len(rows), op='insert')
+
+    def update(self, id, fields):
+        self.update_many([(id, fields)])
+
+    def update_many(self, changes):
+        """Apply a list of (id, fields) changes in one pass and one commit.
+
+        Changes that set the same columns are sent to SQLite together.
+        """
+        groups = defaultdict(list)
+        extras = []
+        for id, fields in changes:
+            columns = tuple(key for key in fields if key in FIELDS)
+            if columns:
+                groups[columns].append([fields[key] for key in columns] + [id])
+            extra = {key: value for key, value in fields.items() if key not in FIELDS}
+            if extra:
+                extras.append((id, extra))
+
+        count('db_rows_written', len(changes), op='update')
+        with self.transaction():
+            for columns, rows in groups.items():
+                assignments = ', '.join(f'{key} = ?' for key in columns)
+                self.conn.executemany(f'UPDATE stories SET {assignments} WHERE id = ?',
+                                      rows)
+            for id, extra in extras:
+                row = self.conn.execute('SELECT extra FROM stories WHERE id = ?',
+                                        (id,)).fetchone()
+                if row is not None:
+                    merged = json.loads(row[0]) if row[0] else {}
+                    merged.update(extra)
+                    self.conn.execute('UPDATE stories SET extra = ? WHERE id = ?',
+                                      (json.dumps(merged), id))
+
+    def change_state(self, from_state, to_state):
+        with self.transaction():
+            self.conn.execute('UPDATE stories SET state = ? WHERE state = ?',
+                              (to_state, from_state))
+
+    def cache_ratings(self, ratings, created):
+        """Store (key, {'rating', 'category', 'topic'}) pairs in the rating cache."""
+        with self.transaction():
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO rating_cache VALUES (?, ?, ?, ?, ?)',
+                [(key, fields['rating'], fields['category'], fields['topic'], created)
+                 for key, fields in ratings])
+
+    def expire_ratings(self, before):
+        with self.transaction():
+            self.conn.execute('DELETE FROM rating_cache WHERE created < ?', (before,))
+
+    def retire_overflow(self, states, keep, target, to_state='old'):
+        """Move all but the newest `keep` of a target's stories in these states to to_state.
+
+        A target of None means the stories that haven't been routed yet.
+
+        Returns how many stories were moved.
+        """
+        marks = ','.join('?' * len(states))
+        with self.transaction():
+            cursor = self.conn.execute(
+                f'UPDATE stories SET state = ? WHERE state IN ({marks}) AND target IS ? '
+                f'AND id NOT IN (SELECT id FROM stories WHERE state IN ({marks}) '
+                f'AND target IS ? ORDER BY timestamp DESC LIMIT ?)',
+                (to_state, *states, target, *states, target, keep))
+        return cursor.rowcount
+
+    def remove_ids(self, ids):
+        with self.transaction():
+            self.conn.executemany('DELETE FROM stories WHERE id = ?',
+                                  [(id,) for id in ids])
+
+def for_target(where, params, target):
+    """Narrow a query to one target's stories, if a target is given."""
+    if target is None:
+        return where, tuple(params)
+    return where + ' AND target = ?', (*params, target)
+
+def entry_to_row(entry):
+    extra = {key: value for key, value in entry.items()
+             if key != 'id' and key not in FIELDS}
+    return ((str(entry['id']),)
+            + tuple(entry.get(key) for key in FIELDS)
+            + (json.dumps(extra) if extra else None,))
+
+def row_to_entry(row):
+    entry = {'id': row['id']}
+    for key in FIELDS:
+        value = row[key]
+        if value is not None:
+            entry[key] = sys.intern(value) if key in INTERNED else value
+    if row['extra']:
+        entry.update(json.loads(row['extra']))
+    return entry
+
+def migrate_tinydb(store, json_path=TINYDB_PATH):
+    """One-shot import of the old TinyDB file. Returns how many were copied.
+
+    Reads the JSON directly rather than going through TinyDB, so it works
+    without tinydb installed. Stories already in the store are left alone.
+    """
+    if not os.path.exists(json_path):
+        return 0
+
+    with open(json_path) as infile:
+        data = json.load(infile)
+
+    entries = []
+    for table in data.values():
+        entries.extend(entry for entry in table.values() if 'id' in entry)
+    # What upgrade() does for a store from before canonical keys and routing;
+    # a fresh store already has the columns, so it's done here
+    for entry in entries:
+        if entry.get('link') and 'canonical' not in entry:
+            entry['canonical'] = canonical_url(entry['link'])
+        if 'target' not in entry and ('rating' in entry or entry.get('state') in ROUTED_STATES):
+            entry['target'] = DEFAULT_TARGET
+
+    before = store.conn.execute('SELECT COUNT(*) FROM stories').fetchone()[0]
+    store.insert_many(entries)
+    after = store.conn.execute('SELECT COUNT(*) FROM stories').fetchone()[0]
+    return after - before
@@ -0,0 +1,87 @@
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import itertools
+import json
+import random
+import re
+import threading
+import time
+
+"""
+Stub mbin API
+
+A stand-in for mbin's link / article creation API, for trying out the HTTP
+poster without touching a real instance. Point poster.json's base_url at
+http://localhost:<port>. Each post it accepts is printed as a JSON line;
+--fail-rate and --delay make it misbehave, to exercise retries and timeouts.
+"""
+
+ENDPOINT = re.compile(r'^/api/magazine/([^/]+)/(link|article)$')
+
+def make_handler(args):
+    entry_ids = itertools.count(1)
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, so the poster's pooled connection gets reused
+        protocol_version = 'HTTP/1.1'
+
+        def reply(self, status, value):
+            data = json.dumps(value).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length', 0))
+            payload = self.rfile.read(length)
+
+            if args.delay:
+                time.sleep(args.delay)
+
+            match = ENDPOINT.match(self.path)
+            if match is None:
+                return self.reply(404, {'detail': 'Not found'})
+            if args.token is not None and self.headers.get('Authorization') != f'Bearer {args.token}':
+                return self.reply(401, {'detail': 'Unauthorized'})
+            if random.random() < args.fail_rate:
+                return self.reply(503, {'detail': 'Injected failure'})
+
+            try:
+                fields = json.loads(payload)
+            except json.JSONDecodeError:
+                return self.reply(400, {'detail': 'Bad JSON'})
+            if not fields.get('title'):
+                return self.reply(400, {'detail': 'Missing title'})
+
+            with lock:
+                entry_id = next(entry_ids)
+                print(json.dumps({'entryId': entry_id, 'magazine': match.group(1),
+                                  'type': match.group(2), **fields}), flush=True)
+            self.reply(201, {'entryId': entry_id, 'magazine': {'name': match.group(1)},
+                             'title': fields['title']})
+
+        def log_message(self, format, *log_args):
+            pass
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description='Fake mbin API for testing the HTTP poster.')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--token', help='require this bearer token')
+    parser.add_argument('--fail-rate', type=float, default=0.0,
+                        help='fraction of posts to answer with a 503')
+    parser.add_argument('--delay', type=float, default=0.0,
+                        help='seconds to wait before answering')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('localhost', args.port), make_handler(args))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+main()
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+from ingest import (MAX_CANDIDATES, MAX_RATING_BATCHES, RATING_BATCH_SIZE,
+                    find_unrated_stories, retire_candidates)
+from routing import default_targets
+from store import Store
+
+def stories(prefix, total, **fields):
+    now = datetime.now()
+    return [dict({'id': f'{prefix}-{index}', 'title': f'{prefix} story {index}',
+                  'link': f'https://example.com/{prefix}/{index}',
+                  'timestamp': (now - timedelta(seconds=index)).isoformat()}, **fields)
+            for index in range(total)]
+
+def test_retiring_candidates_keeps_the_unrated_backlog(tmp_path):
+    store = Store(str(tmp_path / 'stories.db'))
+    backlog = RATING_BATCH_SIZE * MAX_RATING_BATCHES + 50
+    store.insert_many(stories('unrated', backlog, state='new'))
+    store.insert_many(stories('rated', MAX_CANDIDATES + 10, state='avail', rating=3,
+                              target='news'))
+
+    retire_candidates(store, default_targets())
+
+    assert len(store.by_state('new')) == backlog
+    assert len(store.by_state('avail', target='news')) == MAX_CANDIDATES
+    store.close()
+
+def test_unrated_backlog_is_found_behind_rated_candidates(tmp_path):
+    store = Store(str(tmp_path / 'stories.db'))
+    # Newer rated candidates than anything in the backlog, more than the
+    # backlog query would once have looked at
+    store.insert_many(stories('rated', MAX_CANDIDATES + RATING_BATCH_SIZE * MAX_RATING_BATCHES,
+                              state='avail', rating=3, target='news'))
+    older = datetime.now() - timedelta(days=1)
+    store.insert_many([dict(entry, timestamp=older.isoformat())
+                       for entry in stories('unrated', 10, state='new')])
+
+    assert len(find_unrated_stories(store)) == 10
+    store.close()
@@ -0,0 +1,32 @@
+from types import SimpleNamespace
+
+from llm import Completion, LLMClient
+
+def fake_completion(text, prompt_tokens, cached_tokens, completion_tokens):
+    usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                            prompt_tokens_details=SimpleNamespace(cached_tokens=cached_tokens))
+    message = SimpleNamespace(content=text)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+def test_complete_returns_the_reply_with_its_usage(monkeypatch):
+    client = LLMClient(api_key='test')
+    monkeypatch.setattr(client.client.chat.completions, 'create',
+                        lambda **kwargs: fake_completion('(0, None, None)', 900, 512, 7))
+
+    reply = client.complete('prompt', 'dedup')
+    client.close()
+
+    assert isinstance(reply, Completion)
+    assert reply == '(0, None, None)'
+    assert reply.usage == {'prompt_tokens': 900, 'cached_tokens': 512, 'completion_tokens': 7}
+
+def test_complete_with_no_content_is_an_empty_reply(monkeypatch):
+    client = LLMClient(api_key='test')
+    monkeypatch.setattr(client.client.chat.completions, 'create',
+                        lambda **kwargs: fake_completion(None, 900, 0, 0))
+
+    reply = client.complete('prompt', 'dedup')
+    client.close()
+
+    assert reply == ''
+    assert reply.usage['prompt_tokens'] == 900
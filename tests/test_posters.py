@@ -0,0 +1,75 @@
+import pytest
+import requests
+
+import posters
+from posters import HttpPoster, PostError, SubprocessPoster
+
+class FakeResponse:
+    def __init__(self, status_code, text=''):
+        self.status_code = status_code
+        self.text = text
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(posters.time, 'sleep', lambda seconds: None)
+
+def http_poster(monkeypatch, outcomes):
+    """An HttpPoster whose requests get these responses (or raise these
+    errors) in turn; returns it and the list of attempts made."""
+    poster = HttpPoster('http://mbin.invalid', 'token', retries=2)
+    attempts = []
+    def post(endpoint, json, timeout):
+        attempts.append(endpoint)
+        outcome = outcomes[len(attempts) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    monkeypatch.setattr(poster.session, 'post', post)
+    return poster, attempts
+
+@pytest.mark.parametrize('status', [429, 503])
+def test_http_retries_when_the_post_was_turned_away(monkeypatch, status):
+    poster, attempts = http_poster(monkeypatch, [FakeResponse(status), FakeResponse(201, 'ok')])
+    assert poster.post('news', 'usnews', 'Title', url='https://example.com/') == 'ok'
+    assert len(attempts) == 2
+
+@pytest.mark.parametrize('outcome', [FakeResponse(500), FakeResponse(502), FakeResponse(504),
+                                     requests.ReadTimeout('read timed out')])
+def test_http_does_not_retry_when_the_post_may_have_landed(monkeypatch, outcome):
+    poster, attempts = http_poster(monkeypatch, [outcome, FakeResponse(201, 'ok')])
+    with pytest.raises(PostError) as error:
+        poster.post('news', 'usnews', 'Title', url='https://example.com/')
+    assert error.value.maybe_posted
+    assert len(attempts) == 1
+
+def test_http_retries_a_refused_connection(monkeypatch):
+    calls = []
+    poster = HttpPoster('http://127.0.0.1:9', 'token', retries=1, timeout=5)
+    real_post = poster.session.post
+    def post(*args, **kwargs):
+        calls.append(args)
+        return real_post(*args, **kwargs)
+    monkeypatch.setattr(poster.session, 'post', post)
+    with pytest.raises(PostError) as error:
+        poster.post('news', 'usnews', 'Title', url='https://example.com/')
+    assert not error.value.maybe_posted
+    assert len(calls) == 2
+
+def test_subprocess_failure_is_not_retried(tmp_path):
+    attempts = tmp_path / 'attempts'
+    poster = SubprocessPoster(['sh', '-c', f'echo x >> {attempts}; exit 1', 'submit'], retries=2)
+    with pytest.raises(PostError) as error:
+        poster.post('news', 'usnews', 'Title', url='https://example.com/')
+    assert error.value.maybe_posted
+    assert attempts.read_text().count('x') == 1
+
+def test_subprocess_that_cannot_start_is_retried(monkeypatch):
+    attempts = []
+    def run(*args, **kwargs):
+        attempts.append(args)
+        raise FileNotFoundError('no such file')
+    monkeypatch.setattr(posters.subprocess, 'run', run)
+    with pytest.raises(PostError) as error:
+        SubprocessPoster(retries=2).post('news', 'usnews', 'Title', url='https://example.com/')
+    assert not error.value.maybe_posted
+    assert len(attempts) == 3
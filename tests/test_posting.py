@@ -0,0 +1,77 @@
+from datetime import datetime, timedelta
+import json
+
+import pytest
+
+import posting
+from posters import PostError
+from routing import Target
+from store import Store
+
+class FakeClient:
+    def __init__(self, reply):
+        self.reply = reply
+
+    def complete(self, prompt, site, deadline=None, json_mode=False):
+        return self.reply
+
+class MaybePostedPoster:
+    """Fails every post as if it timed out after mbin got it."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def post(self, user, magazine, title, url=None, body=None):
+        self.calls += 1
+        raise PostError('timed out after 60s', maybe_posted=True)
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = Store(str(tmp_path / 'stories.db'))
+    yield store
+    store.close()
+
+def story(id, state, timestamp, **fields):
+    return dict({'id': id, 'title': f'Story {id}', 'link': f'https://example.com/{id}',
+                 'feed': 'https://example.com/feed', 'published': timestamp,
+                 'timestamp': timestamp, 'state': state, 'rating': 4, 'target': 'news'},
+                **fields)
+
+def test_maybe_posted_link_is_not_posted_again(store):
+    store.insert_many([story('pick', 'post', datetime.now().isoformat())])
+    poster = MaybePostedPoster()
+    client = FakeClient('0, None, None)')
+
+    for pass_number in range(2):
+        posting.run_posting(store, client, poster, [Target('news')])
+
+    assert poster.calls == 1
+    assert store.get('pick')['state'] == posting.UNCONFIRMED
+    assert store.get('pick')['unconfirmed_from'] == 'post'
+
+def test_maybe_posted_roundup_is_not_posted_again(store):
+    due = (datetime.now() - timedelta(hours=posting.QUEUE_DELAY + 1)).isoformat()
+    store.insert_many([story('first', 'queued', due, schedule_timestamp=due),
+                       story('second', 'queued', due, schedule_timestamp=due)])
+    poster = MaybePostedPoster()
+    client = FakeClient(json.dumps({'ids': [0, 1], 'title': 'Roundup', 'body': '* Both'}))
+
+    for pass_number in range(2):
+        posting.run_posting(store, client, poster, [Target('news')])
+
+    assert poster.calls == 1
+    assert {store.get(id)['state'] for id in ('first', 'second')} == {posting.UNCONFIRMED}
+
+def test_unparseable_dedup_reply_is_retried_then_given_up(store):
+    store.insert_many([story('pick', 'post', datetime.now().isoformat())])
+    poster = MaybePostedPoster()
+    client = FakeClient('I cannot tell.')
+
+    for pass_number in range(posting.MAX_DEDUP_FAILURES):
+        assert store.get('pick')['state'] == 'post'
+        assert posting.post_story(store, client, poster, Target('news')) is False
+
+    assert store.get('pick')['state'] == 'old'
+    assert not posting.post_story(store, client, poster, Target('news'))
+    assert poster.calls == 0
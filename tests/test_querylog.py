@@ -0,0 +1,16 @@
+from llm import Completion
+from querylog import log_query, read_queries
+
+def test_log_query_records_token_usage(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = str(tmp_path / 'queries.jsonl')
+    completion = Completion('[0, "***", "world", "Trade"]')
+    completion.usage = {'prompt_tokens': 1200, 'cached_tokens': 1024, 'completion_tokens': 12}
+
+    log_query('rate', 'prompt', completion, ['story'], path=path)
+    log_query('dedup', 'prompt', '(0, None, None)', ['story'], path=path)
+
+    rated, deduped = read_queries(path)
+    assert rated['completion'] == '[0, "***", "world", "Trade"]'
+    assert rated['usage'] == completion.usage
+    assert 'usage' not in deduped
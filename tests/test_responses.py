@@ -0,0 +1,71 @@
+import os
+
+import pytest
+
+from responses import ParseError, parse_dedup, parse_ratings, parse_roundup
+
+# Model replies in the formats it's been seen to send, one per file
+REPLIES_DIR = os.path.join(os.path.dirname(__file__), 'replies')
+
+def reply(name):
+    with open(os.path.join(REPLIES_DIR, name)) as infile:
+        return infile.read()
+
+@pytest.mark.parametrize('name, expected', [
+    ('rate-line-per-row.txt', [(0, 4, 'world', 'Ukraine war'),
+                               (1, 2, 'us-only', 'Local politics'),
+                               (2, 5, 'world', 'Earthquake')]),
+    ('rate-fenced.txt', [(0, 3, 'world', 'Climate summit'),
+                         (1, 1, 'us-only', 'Sports')]),
+    ('rate-array.txt', [(0, 4, 'world', 'Elections'),
+                        (1, 3, 'us-only', 'Congress'),
+                        (2, 5, 'world', 'Markets')]),
+    # The unclosed row and the one without stars are dropped; the rest survive
+    ('rate-broken-row.txt', [(0, 3, 'world', 'Trade'),
+                             (3, 2, 'world', 'Tech')]),
+])
+def test_parse_ratings(name, expected):
+    assert parse_ratings(reply(name)) == expected
+
+def test_parse_ratings_of_nothing():
+    assert parse_ratings('Sorry, I can only rate news stories.') == []
+
+@pytest.mark.parametrize('name, expected', [
+    ('dedup-tuple-new.txt', (0, None, False)),
+    ('dedup-tuple-us-only.txt', (0, None, True)),
+    # 2: a duplicate of story n
+    ('dedup-tuple-dupe.txt', (2, 5, False)),
+    # 1: the same topic as story n
+    ('dedup-tuple-topic.txt', (1, 3, True)),
+    # The prompt ends with "The result is: (", so the model usually carries
+    # on from there
+    ('dedup-prefilled-new.txt', (0, None, False)),
+    ('dedup-prefilled-us-only.txt', (0, None, True)),
+    ('dedup-prefilled-dupe.txt', (2, 4, False)),
+    ('dedup-prefilled-topic.txt', (1, 0, True)),
+])
+def test_parse_dedup(name, expected):
+    assert parse_dedup(reply(name)) == expected
+
+def test_parse_dedup_without_a_status():
+    with pytest.raises(ParseError):
+        parse_dedup('I am not sure.')
+
+def test_parse_roundup_fenced():
+    # Out of range, non-numeric and repeated ids are dropped, and story 0
+    # is kept first
+    assert parse_roundup(reply('roundup-fenced.txt'), 5) == {
+        'ids': [0, 2], 'title': 'Storms hit the coast', 'body': '* Story one\n* Story two'}
+
+def test_parse_roundup_without_an_object():
+    with pytest.raises(ParseError):
+        parse_roundup('[1, 2, 3]', 5)
+
+# A reply with no content (LLMClient hands that over as ''), or only whitespace
+@pytest.mark.parametrize('text', [None, reply('empty.txt'), reply('blank.txt')])
+def test_empty_replies(text):
+    assert parse_ratings(text) == []
+    with pytest.raises(ParseError):
+        parse_dedup(text)
+    with pytest.raises(ParseError):
+        parse_roundup(text, 3)
@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta
+import json
+
+from routing import DEFAULT_TARGET
+from store import Store, migrate_tinydb
+from urls import canonical_url
+
+def write_tinydb(path, entries):
+    with open(path, 'w') as outfile:
+        json.dump({'_default': {str(index + 1): entry for index, entry in enumerate(entries)}},
+                  outfile)
+
+def test_migrate_tinydb_routes_rated_and_posted_stories(tmp_path):
+    now = datetime.now()
+    earlier = (now - timedelta(minutes=30)).isoformat()
+    tinydb = tmp_path / 'rss-feed-data.json'
+    write_tinydb(tinydb, [
+        {'id': 'posted', 'title': 'Posted', 'link': 'https://example.com/posted',
+         'timestamp': earlier, 'state': 'posted', 'rating': 4, 'post_timestamp': earlier},
+        {'id': 'queued', 'title': 'Queued', 'link': 'https://example.com/queued',
+         'timestamp': earlier, 'state': 'queued', 'schedule_timestamp': earlier},
+        {'id': 'avail', 'title': 'Avail', 'link': 'https://example.com/avail',
+         'timestamp': earlier, 'state': 'avail', 'rating': 3},
+        {'id': 'new', 'title': 'New', 'link': 'https://example.com/new',
+         'timestamp': earlier, 'state': 'new'},
+    ])
+
+    store = Store(str(tmp_path / 'stories.db'))
+    assert migrate_tinydb(store, str(tinydb)) == 4
+
+    since = (now - timedelta(hours=1)).isoformat()
+    assert store.count_posted_since(since, target=DEFAULT_TARGET) == 1
+    assert [entry['id'] for entry in store.queued_before(now.isoformat(), target=DEFAULT_TARGET)] \
+        == ['queued']
+    assert [entry['id'] for entry in store.by_state('avail', target=DEFAULT_TARGET)] == ['avail']
+    assert 'target' not in store.get('new')
+    store.close()
+
+def test_migrate_tinydb_sets_canonical_keys(tmp_path):
+    tinydb = tmp_path / 'rss-feed-data.json'
+    link = 'https://www.example.com/2024/story?utm_source=rss'
+    write_tinydb(tinydb, [{'id': link, 'title': 'Story', 'link': link,
+                           'timestamp': datetime.now().isoformat(), 'state': 'old'}])
+
+    store = Store(str(tmp_path / 'stories.db'))
+    migrate_tinydb(store, str(tinydb))
+
+    key = canonical_url('https://example.com/2024/story')
+    assert store.get(link)['canonical'] == canonical_url(link)
+    assert store.by_canonical({key})[key]['id'] == link
+    store.close()
+
+def query_plan(store, call):
+    """The query plan of each statement `call` runs against the store, as a string."""
+    statements = []
+    store.conn.set_trace_callback(statements.append)
+    call()
+    store.conn.set_trace_callback(None)
+    return ' / '.join(row['detail'] for statement in statements
+                      if statement.startswith('SELECT')
+                      for row in store.conn.execute('EXPLAIN QUERY PLAN ' + statement))
+
+def test_candidate_queries_use_indexes_after_analyze(tmp_path):
+    store = Store(str(tmp_path / 'stories.db'))
+    now = datetime.now()
+    entries = []
+    for index in range(5000):
+        entry = {'id': f'story-{index}', 'title': f'Story {index}',
+                 'timestamp': (now - timedelta(minutes=index)).isoformat(),
+                 'state': ('old', 'old', 'old', 'posted', 'avail', 'new')[index % 6]}
+        if index % 12 != 5:
+            entry.update(rating=index % 5 + 1, target=('news', 'tech')[index % 2])
+        entries.append(entry)
+    store.insert_many(entries)
+    store.conn.execute('ANALYZE')
+
+    plan = query_plan(store, lambda: store.best_rated('new', 'avail', 'highlight', target='news'))
+    assert 'USING INDEX stories_state_target_rating' in plan
+    assert 'SCAN stories' not in plan
+
+    plan = query_plan(store, lambda: store.unrated(limit=100))
+    assert 'USING INDEX stories_unrated' in plan
+    assert 'TEMP B-TREE' not in plan
+    store.close()
@@ -0,0 +1,74 @@
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+"""
+URL Canonicalization
+
+The same article turns up under several URLs: with tracking parameters
+tacked on, over http or https, with or without www., or as the AMP or mobile
+version. canonical_url() boils a link down to a key that's the same for all
+of those, so ingest can tell it already has the story.
+
+The key is only for matching; it isn't meant to be fetched. Stories keep
+their original link for posting.
+"""
+
+# Query parameters that only say where the click came from
+TRACKING_PARAMS = {'fbclid', 'gclid', 'dclid', 'msclkid', 'mc_cid', 'mc_eid',
+                   'cmpid', 'cmp', 'ocid', 'smid', 'smtyp', 'sr_share', 'ito',
+                   'ref', 'ref_src', 'referrer', 'src', 'source', 'via',
+                   'at_medium', 'at_campaign', 'at_custom1', 'at_custom2',
+                   'at_custom3', 'at_custom4', 'rss', 'feed', 'ns_mchannel',
+                   'ns_source', 'ns_campaign', 'ns_linkname', 'ns_fee',
+                   'guccounter', 'outputtype', 'amp', 'output'}
+TRACKING_PREFIXES = ('utm_', 'pk_', 'mtm_', 'itm_', 'hsa_', '__')
+
+# Host prefixes for the same site
+HOST_PREFIXES = ('www.', 'amp.', 'm.', 'mobile.')
+
+AMP_SUFFIX = re.compile(r'(/amp/?|\.amp)$')
+AMP_CACHE_PATH = re.compile(r'^/[a-z](?:/s)?/([^/]+)(/.*)?$')
+
+def canonical_host(host):
+    host = host.lower().rstrip('.')
+    if host.endswith(':80') or host.endswith(':443'):
+        host = host.rsplit(':', 1)[0]
+    for prefix in HOST_PREFIXES:
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+            break
+    return host
+
+def canonical_url(url):
+    """A matching key for a link, or None if it isn't a web URL."""
+    if not url:
+        return None
+    parts = urlsplit(url.strip())
+    if parts.scheme.lower() not in ('http', 'https') or not parts.netloc:
+        return None
+
+    host = canonical_host(parts.netloc)
+    path = parts.path
+
+    # Google's AMP cache puts the origin in the path: /c/s/example.com/story
+    if host.endswith('.cdn.ampproject.org'):
+        match = AMP_CACHE_PATH.match(path)
+        if match:
+            host = canonical_host(match.group(1))
+            path = match.group(2) or '/'
+
+    if path.startswith('/amp/'):
+        path = path[len('/amp'):]
+    path = re.sub(r'\.amp(\.html?)$', r'\1', path)
+    path = AMP_SUFFIX.sub('', path)
+    path = re.sub(r'/{2,}', '/', path).rstrip('/') or '/'
+
+    query = sorted((key, value)
+                   for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if key.lower() not in TRACKING_PARAMS
+                   and not key.lower().startswith(TRACKING_PREFIXES))
+
+    key = host + path
+    if query:
+        key += '?' + urlencode(query)
+    return key